@@ -0,0 +1,286 @@
+"""Headless batch proposal generation.
+
+Runs extraction, research, generation, improvement and DOCX rendering for a queue of
+jobs across a bounded pool of workers:
+
+    python batch.py jobs/ --output out/ --workers 4 --llm ollama --model llama3.1:latest
+    python batch.py manifest.jsonl --output out/ --llm fake --no-research
+
+A manifest is a JSON list or JSON-lines file of jobs; a directory holds one
+subdirectory per job with a ``job.json`` and its attachment files. Job fields:
+``id``, ``client_name``, ``project_type``, ``requirements``, ``additional_info``,
+``attachments`` (paths relative to the manifest/job directory) and ``comments``
+(section -> reviewer comment). Finished jobs are recorded in ``progress.jsonl`` in
+the output directory and skipped when the batch is run again.
+"""
+import argparse
+import contextvars
+import json
+import logging
+import os
+import re
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from config import MODEL_CHOICES, build_llm, build_llm_chain, get_context_budget
+from docx_generator import render_docx
+from extraction_cache import get_extraction_cache
+from extractors import extract_texts
+from generation import ensure_required_keys, generate_proposal, generate_proposal_by_section, prepare_generation_inputs
+from improve import improve_proposal, improve_sections
+from library import get_proposal_library
+from llm_cache import get_response_cache
+from research import get_search_backend, perform_research
+from streaming import StreamAborted
+from tracing import get_tracer, span
+
+class LocalFile:
+    # Minimal file object with the name/getvalue interface extract_texts expects from uploads
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+
+    def getvalue(self):
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+class JobTimeout(StreamAborted):
+    pass
+
+def _job_id(job, default):
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", str(job.get("id") or default))
+
+def load_jobs(source):
+    jobs = []
+    if os.path.isdir(source):
+        for entry in sorted(os.listdir(source)):
+            job_dir = os.path.join(source, entry)
+            job_file = os.path.join(job_dir, "job.json")
+            if not os.path.isfile(job_file):
+                continue
+            with open(job_file, 'r', encoding='utf-8') as f:
+                job = json.load(f)
+            if "attachments" not in job:
+                job["attachments"] = sorted(name for name in os.listdir(job_dir) if name != "job.json")
+            job["id"] = _job_id(job, entry)
+            job["base_dir"] = job_dir
+            jobs.append(job)
+        return jobs
+
+    with open(source, 'r', encoding='utf-8') as f:
+        content = f.read()
+    if source.endswith('.jsonl'):
+        records = [json.loads(line) for line in content.splitlines() if line.strip()]
+    else:
+        records = json.loads(content)
+    for index, job in enumerate(records):
+        job["id"] = _job_id(job, f"job-{index + 1}")
+        job.setdefault("base_dir", os.path.dirname(os.path.abspath(source)))
+        jobs.append(job)
+    return jobs
+
+def run_job(job, llm, options, cancelled=None):
+    """Run one job end to end and write its outputs; returns the seconds spent per stage.
+
+    Once ``cancelled`` (a threading.Event) is set, the job stops at the next stage,
+    research search or streamed chunk and writes nothing.
+    """
+    timings = {}
+
+    def check_cancelled(*args):
+        if cancelled is not None and cancelled.is_set():
+            raise JobTimeout(f"timed out after {options.timeout} seconds")
+
+    def timed(stage, func, *args, **kwargs):
+        check_cancelled()
+        started = time.perf_counter()
+        result = func(*args, **kwargs)
+        timings[stage] = round(time.perf_counter() - started, 3)
+        return result
+
+    files = [LocalFile(os.path.join(job["base_dir"], path)) for path in job.get("attachments", [])]
+    documents = timed("extraction", extract_texts, files, cache=get_extraction_cache()) if files else []
+
+    research = None
+    if not options.no_research:
+        backend = get_search_backend(options.search)
+        research = lambda user_input, additional_info, llm: perform_research(
+            user_input, additional_info, llm, backend=backend, check_cancelled=check_cancelled
+        )
+    client_name = job.get("client_name", "")
+    project_type = job.get("project_type", "Other")
+    library = None if options.no_library else get_proposal_library()
+    inputs = timed(
+        "research", prepare_generation_inputs,
+        llm, job.get("requirements", ""), documents, job.get("additional_info", ""), options.context_budget,
+        research=research, library=library, project_type=project_type
+    )
+    if inputs["research_warning"]:
+        logging.warning(f"[{job['id']}] {inputs['research_warning']}")
+
+    if options.section_mode:
+        draft = timed(
+            "generation", generate_proposal_by_section,
+            llm, client_name, project_type, inputs["user_input"], job.get("additional_info", ""),
+            section_context=inputs["section_context"], section_drafts=inputs["section_drafts"],
+            max_concurrency=options.max_concurrency, on_update=check_cancelled
+        )
+    else:
+        draft = timed(
+            "generation", generate_proposal, llm, client_name, project_type, inputs["user_input"], job.get("additional_info", ""),
+            on_update=check_cancelled
+        )
+
+    comments = {section: job.get("comments", {}).get(section, "") for section in draft}
+    if options.full_improve:
+        improved = timed("improvement", improve_proposal, draft, comments, llm, on_update=check_cancelled)
+    else:
+        improved = timed("improvement", improve_sections, draft, comments, llm,
+                         max_concurrency=options.max_concurrency, on_update=check_cancelled)
+    final_proposal = ensure_required_keys(improved, draft)
+    docx_bytes = timed("rendering", render_docx, final_proposal, client_name)
+
+    # Nothing is stored or written for a job that has already been reported as timed out
+    check_cancelled()
+    if library is not None:
+        library.add(final_proposal, client_name, project_type, job.get("requirements", ""))
+
+    with open(os.path.join(options.output, f"{job['id']}.docx"), 'wb') as f:
+        f.write(docx_bytes)
+    with open(os.path.join(options.output, f"{job['id']}.json"), 'w', encoding='utf-8') as f:
+        json.dump(final_proposal, f, indent=2)
+    return timings
+
+def run_with_timeout(func, timeout, *args):
+    # Threads can't be killed. A job that overruns is asked to stop through the ``cancelled``
+    # event and its worker slot is held until it has, so no more than --workers jobs ever
+    # call the model at once.
+    outcome = {}
+    cancelled = threading.Event()
+
+    def target():
+        try:
+            outcome["result"] = func(*args, cancelled=cancelled)
+        except BaseException as e:
+            outcome["error"] = e
+
+    # Run in a copy of the caller's context so tracing spans nest under the job's span
+    thread = threading.Thread(target=contextvars.copy_context().run, args=(target,), daemon=True)
+    thread.start()
+    thread.join(timeout)
+    if thread.is_alive():
+        cancelled.set()
+        logging.warning(f"Job timed out after {timeout} seconds; waiting for its current step to stop")
+        thread.join()
+    # A job that finished despite the timeout has written its outputs, so it counts as done
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["result"]
+
+def load_progress(path):
+    completed = set()
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    if record["status"] == "ok":
+                        completed.add(record["id"])
+    return completed
+
+PROVIDERS = {"ollama": "Ollama", "openrouter": "OpenRouter", "openai": "OpenAI", "fake": "Fake"}
+
+def make_llm(options):
+    api = PROVIDERS[options.llm]
+    if api == "Fake":
+        return build_llm(api, "fake", "", options.temperature, cache=False)
+    providers = [(api, options.model, os.environ.get("LLM_API_KEY", ""))]
+    for spec in options.fallback:
+        # "provider" or "provider:model"; keys come from OPENAI_API_KEY / OPENROUTER_API_KEY
+        name, _, model = spec.partition(":")
+        fallback_api = PROVIDERS[name]
+        providers.append((fallback_api, model or MODEL_CHOICES[fallback_api][0], os.environ.get(f"{fallback_api.upper()}_API_KEY", "")))
+    return build_llm_chain(providers, options.temperature, cache_for=(lambda api: False) if options.no_cache else get_response_cache)
+
+def run_batch(options):
+    os.makedirs(options.output, exist_ok=True)
+    jobs = load_jobs(options.source)
+    progress_path = os.path.join(options.output, "progress.jsonl")
+    completed = load_progress(progress_path)
+    pending = [job for job in jobs if job["id"] not in completed]
+    logging.info(f"{len(jobs)} jobs, {len(jobs) - len(pending)} already done, {len(pending)} to run")
+
+    llm = make_llm(options)
+    progress_lock = threading.Lock()
+    records = []
+    started = time.perf_counter()
+
+    def work(job):
+        job_started = time.perf_counter()
+        try:
+            with span("batch.job", job=job["id"]):
+                timings = run_with_timeout(run_job, options.timeout, job, llm, options)
+            record = {"id": job["id"], "status": "ok", "timings": timings}
+        except Exception as e:
+            logging.error(f"[{job['id']}] failed: {str(e)}")
+            record = {"id": job["id"], "status": "timeout" if isinstance(e, JobTimeout) else "error", "error": str(e)}
+        record["seconds"] = round(time.perf_counter() - job_started, 3)
+        with progress_lock:
+            with open(progress_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record) + "\n")
+        return record
+
+    with ThreadPoolExecutor(max_workers=options.workers) as executor:
+        for future in as_completed([executor.submit(work, job) for job in pending]):
+            record = future.result()
+            records.append(record)
+            logging.info(f"[{record['id']}] {record['status']} in {record['seconds']} s ({len(records)}/{len(pending)})")
+
+    elapsed = time.perf_counter() - started
+    durations = sorted(record["seconds"] for record in records if record["status"] == "ok")
+    summary = {
+        "jobs": len(jobs),
+        "skipped": len(jobs) - len(pending),
+        "succeeded": len(durations),
+        "failed": [{"id": r["id"], "status": r["status"], "error": r["error"]} for r in records if r["status"] != "ok"],
+        "wall_seconds": round(elapsed, 3),
+        "jobs_per_minute": round(len(records) / elapsed * 60, 2) if elapsed and records else 0.0,
+        "mean_job_seconds": round(statistics.mean(durations), 3) if durations else None,
+        "p95_job_seconds": durations[min(len(durations) - 1, int(len(durations) * 0.95))] if durations else None,
+    }
+    with open(os.path.join(options.output, "summary.json"), 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2)
+    with open(os.path.join(options.output, "metrics.prom"), 'w', encoding='utf-8') as f:
+        f.write(get_tracer().to_prometheus())
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate proposals for a queue of jobs without the Streamlit UI")
+    parser.add_argument("source", help="Job manifest (.json/.jsonl) or directory of job folders")
+    parser.add_argument("--output", default="batch_output", help="Directory for DOCX/JSON output, progress and summary")
+    parser.add_argument("--workers", type=int, default=2, help="Jobs run concurrently")
+    parser.add_argument("--timeout", type=float, default=900, help="Seconds before a job is stopped and recorded as timed out; a non-streamed model call in progress finishes first")
+    parser.add_argument("--llm", choices=["ollama", "openrouter", "openai", "fake"], default="ollama")
+    parser.add_argument("--model", default="llama3.1:latest")
+    parser.add_argument("--fallback", action="append", default=[], metavar="PROVIDER[:MODEL]",
+                        help="Provider to fall back to when the main one fails, e.g. ollama:llama3.1:latest; repeatable")
+    parser.add_argument("--temperature", type=float, default=0.7)
+    parser.add_argument("--context-budget", type=int, default=None, help="Defaults to the model's budget from config")
+    parser.add_argument("--section-mode", action="store_true", help="Generate sections with concurrent calls")
+    parser.add_argument("--max-concurrency", type=int, default=4, help="Concurrent section calls when generating or improving")
+    parser.add_argument("--full-improve", action="store_true", help="Rewrite the whole proposal instead of only commented sections")
+    parser.add_argument("--search", default=os.environ.get("RESEARCH_SEARCH_BACKEND", "duckduckgo"), help="duckduckgo or offline:<dir>")
+    parser.add_argument("--no-research", action="store_true")
+    parser.add_argument("--no-library", action="store_true", help="Neither reuse nor store proposals in the proposal library")
+    parser.add_argument("--no-cache", action="store_true", help="Don't use the LLM response cache")
+    options = parser.parse_args()
+    if options.context_budget is None:
+        options.context_budget = get_context_budget(options.model)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    summary = run_batch(options)
+    print(json.dumps(summary, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,626 @@
+import argparse
+import datetime
+import http.server
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+import fitz
+import openpyxl
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Border, Side
+import retrieval
+from docx import Document
+import clients
+from config import build_llm, build_llm_chain
+from langchain_community.chat_models import ChatOpenAI
+from langchain_community.llms import Ollama
+from langchain_core.prompts import PromptTemplate
+from docx_generator import generate_docx, render_docx
+from extractors import extract_texts, iter_xlsx_rows
+from fakes import FakeSearchBackend, stub_response
+from generation import generate_proposal, get_output_parser, prepare_generation_inputs
+from improve import improve_proposal, improve_sections
+from library import ProposalLibrary
+from llm_cache import LLMResponseCache, stream_text
+from response_store import ResponseStore
+from research import perform_research
+from streaming import message_text, parse_partial_json
+from templates import REQUIRED_KEYS
+
+RESULTS_DIR = os.environ.get("BENCHMARK_RESULTS_DIR", "benchmark_results")
+# Pages of PDF per fixture size; the DOCX and XLSX fixtures scale with it
+FIXTURE_SIZES = {"small": 5, "medium": 40, "large": 160}
+REQUIREMENTS = "Build a customer portal with single sign-on, reporting dashboards and an integration with the existing ERP system."
+RFP_TOPICS = [
+    "The vendor shall provide single sign-on using the client's identity provider.",
+    "Reporting dashboards must refresh nightly and support export to Excel.",
+    "Integration with the ERP system covers orders, invoices and inventory levels.",
+    "Hosting must be in a US region with daily backups and a 99.9% availability target.",
+    "The project timeline should not exceed six months from kickoff to go-live.",
+    "Support and maintenance are required for twelve months after launch.",
+    "Risks include data quality in the legacy system and availability of client SMEs.",
+    "Pricing should be broken down by phase with time and materials estimates.",
+]
+
+def measure(func, *args, **kwargs):
+    # Wall time and peak Python heap allocation of a single call
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = func(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, elapsed, peak
+
+def make_xlsx(rows, cols, sheets=1, blank_cols=20, blank_row_every=10):
+    # Pricing-style workbook as they often arrive: a border formatted far to the right of the
+    # data and blank spacer rows. Styled cells are stored even without a value, so every row
+    # reads back with a run of empty trailing cells.
+    workbook = openpyxl.Workbook(write_only=True)
+    border = Border(bottom=Side(style="thin"))
+    for sheet_index in range(sheets):
+        sheet = workbook.create_sheet(f"Sheet{sheet_index + 1}")
+        for row_index in range(rows):
+            edge = WriteOnlyCell(sheet)
+            edge.border = border
+            if blank_row_every and row_index % blank_row_every == blank_row_every - 1:
+                sheet.append([None] * (cols + blank_cols - 1) + [edge])
+                continue
+            row = [f"Item {row_index}"] + [row_index * col for col in range(1, cols)]
+            sheet.append(row + [None] * (blank_cols - 1) + [edge])
+    data = io.BytesIO()
+    workbook.save(data)
+    return data.getvalue()
+
+def extract_xlsx_full(data):
+    # The original full-mode extraction path, kept here as the benchmark baseline
+    workbook = openpyxl.load_workbook(io.BytesIO(data))
+    text = ""
+    for sheet_name in workbook.sheetnames:
+        sheet = workbook[sheet_name]
+        text += f"Sheet: {sheet_name}\n"
+        for row in sheet.iter_rows(values_only=True):
+            text += "\t".join(str(cell) for cell in row) + "\n"
+    return text
+
+def extract_xlsx_streaming(data):
+    return "".join(iter_xlsx_rows(data))
+
+def bench_xlsx(rows, cols, sheets):
+    data = make_xlsx(rows, cols, sheets)
+    print(f"Workbook: {rows} rows x {cols} cols x {sheets} sheets, {len(data) / (1024 * 1024):.1f} MB")
+    for name, func in [("full", extract_xlsx_full), ("streaming", extract_xlsx_streaming)]:
+        text, elapsed, peak = measure(func, data)
+        print(f"{name:>10}: {elapsed:8.3f} s  peak {peak / (1024 * 1024):8.1f} MB  {len(text):>10} chars")
+
+def make_proposal(paragraphs_per_section, words_per_paragraph=80):
+    paragraph = " ".join(["lorem"] * words_per_paragraph)
+    proposal = {section: "\n".join([paragraph] * paragraphs_per_section) for section in REQUIRED_KEYS}
+    proposal["date"] = "2024-01-01"
+    proposal["project_name"] = "Benchmark Project"
+    return proposal
+
+def render_docx_reload(proposal, client_name):
+    # The original render path: save, re-parse, count paragraphs for the footer, save again
+    doc = generate_docx(proposal, client_name)
+    docx_bytes = io.BytesIO()
+    doc.save(docx_bytes)
+    docx_bytes.seek(0)
+    doc = Document(docx_bytes)
+    page_count = len(doc.element.xpath('//w:p'))
+    doc.sections[0].footer.paragraphs[0].text = f"Page 1 of {page_count}"
+    updated_docx_bytes = io.BytesIO()
+    doc.save(updated_docx_bytes)
+    return updated_docx_bytes.getvalue()
+
+def bench_docx(paragraphs, repeat):
+    proposal = make_proposal(paragraphs)
+    print(f"Proposal: {len(REQUIRED_KEYS)} sections x {paragraphs} paragraphs")
+    for name, func in [("reload", render_docx_reload), ("single-pass", render_docx)]:
+        timings = []
+        for _ in range(repeat):
+            data, elapsed, peak = measure(func, proposal, "Benchmark Client")
+            timings.append(elapsed)
+        print(f"{name:>12}: {min(timings):8.3f} s  peak {peak / (1024 * 1024):8.1f} MB  {len(data) / 1024:8.0f} KB")
+
+class FixtureFile:
+    # In-memory upload with the name/getvalue interface of Streamlit's UploadedFile
+    def __init__(self, name, data):
+        self.name = name
+        self.data = data
+
+    def getvalue(self):
+        return self.data
+
+def rfp_paragraph(index):
+    # Deterministic RFP-like prose, varied enough that retrieval has something to rank
+    return f"Requirement {index}. " + " ".join(RFP_TOPICS[(index + offset) % len(RFP_TOPICS)] for offset in range(3))
+
+def make_pdf(pages, paragraphs_per_page=6):
+    pdf = fitz.open()
+    for page_index in range(pages):
+        page = pdf.new_page()
+        text = "\n\n".join(rfp_paragraph(page_index * paragraphs_per_page + i) for i in range(paragraphs_per_page))
+        page.insert_textbox(fitz.Rect(50, 50, 550, 800), text, fontsize=9)
+    data = pdf.tobytes()
+    pdf.close()
+    return data
+
+def make_docx(paragraphs):
+    doc = Document()
+    doc.add_heading("Request for Proposal", 0)
+    for index in range(paragraphs):
+        doc.add_paragraph(rfp_paragraph(index))
+    data = io.BytesIO()
+    doc.save(data)
+    return data.getvalue()
+
+def make_fixtures(size):
+    pages = FIXTURE_SIZES[size]
+    return [
+        FixtureFile(f"rfp_{size}.pdf", make_pdf(pages)),
+        FixtureFile(f"rfp_{size}.docx", make_docx(pages * 5)),
+        FixtureFile(f"pricing_{size}.xlsx", make_xlsx(pages * 50, 8, blank_cols=5)),
+    ]
+
+SCENARIOS = ["extraction", "prompt_assembly", "research", "parsing", "improvement", "incremental_improvement", "docx", "end_to_end"]
+
+class Suite:
+    """End-to-end scenarios run offline against the fake model and search backend."""
+
+    def __init__(self, llm_latency=0.0, token_latency=0.0, search_latency=0.0):
+        self.settings = {"llm_latency": llm_latency, "token_latency": token_latency, "search_latency": search_latency}
+        self.llm = build_llm("Fake", "fake", "", 0.0, cache=False)
+        self.llm.latency = llm_latency
+        self.llm.token_latency = token_latency
+        self.search_backend = FakeSearchBackend(latency=search_latency)
+        self.parser = get_output_parser()
+        self.completion = stub_response("")
+        # The same completion as models often return it: fenced, with chatter, a stray backslash and a trailing comma
+        self.damaged_completion = "Here is the proposal:\n```json\n" + self.completion.replace("Stub scope.", "Stub scope \\ phase 1.").replace("\n}", ",\n}") + "\n```"
+        self.draft = json.loads(self.completion)
+        self.comments = {section: "Be more specific." if section in ("scope", "approach") else "" for section in self.draft}
+
+    # Each scenario takes the fixture uploads and their already extracted text
+
+    def extraction(self, files, documents):
+        return extract_texts(files)
+
+    def prompt_assembly(self, files, documents):
+        # Drop indexes built by earlier runs so each run pays for indexing, as a new upload would
+        retrieval._indexes.clear()
+        return prepare_generation_inputs(self.llm, REQUIREMENTS, documents, "", 12000, research=None)
+
+    def research(self, files, documents):
+        # A fresh store per run, so searches and the agent aren't answered from cache
+        return perform_research(REQUIREMENTS, "", self.llm, backend=self.search_backend, cache=ResponseStore(":memory:"))
+
+    def parsing(self, files, documents):
+        # Streamed partial parses followed by the final structured parse, then a repaired one
+        for end in range(0, len(self.completion), 64):
+            parse_partial_json(self.completion[:end])
+        self.parser.parse(self.completion)
+        return self.parser.parse(self.damaged_completion)
+
+    def improvement(self, files, documents):
+        return improve_proposal(self.draft, self.comments, self.llm)
+
+    def incremental_improvement(self, files, documents):
+        return improve_sections(self.draft, self.comments, self.llm)
+
+    def docx(self, files, documents):
+        return render_docx(self.draft, "Benchmark Client")
+
+    def end_to_end(self, files, documents):
+        documents = extract_texts(files)
+        retrieval._indexes.clear()
+        research = lambda user_input, additional_info, llm: perform_research(
+            user_input, additional_info, llm, backend=self.search_backend, cache=ResponseStore(":memory:")
+        )
+        inputs = prepare_generation_inputs(self.llm, REQUIREMENTS, documents, "", 12000, research=research)
+        draft = generate_proposal(self.llm, "Benchmark Client", "Software Development", inputs["user_input"], "")
+        final_proposal = improve_sections(draft, self.comments, self.llm)
+        return render_docx(final_proposal, "Benchmark Client")
+
+class MockProvider:
+    """Local HTTP server answering OpenAI chat-completion and Ollama generate requests.
+
+    Counts TCP connections and requests, can add latency, and can fail the first
+    ``fail_first`` requests (or every request) with ``status``.
+    """
+
+    def __init__(self, latency=0.0, fail_first=0, always_fail=False, status=503):
+        self.latency = latency
+        self.fail_first = fail_first
+        self.always_fail = always_fail
+        self.status = status
+        self.connections = 0
+        self.requests = 0
+        self._lock = threading.Lock()
+        provider = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body go out in separate writes; don't let Nagle hold the body back
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+                with provider._lock:
+                    provider.connections += 1
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                with provider._lock:
+                    provider.requests += 1
+                    failing = provider.always_fail or provider.requests <= provider.fail_first
+                time.sleep(provider.latency)
+                if failing:
+                    self._send(provider.status, "application/json", b'{"error": {"message": "unavailable"}}')
+                elif self.path.endswith("/chat/completions"):
+                    self._send(200, "application/json", json.dumps({
+                        "id": "mock", "object": "chat.completion", "created": 0, "model": request.get("model", "mock"),
+                        "choices": [{"index": 0, "message": {"role": "assistant", "content": "mock response"}, "finish_reason": "stop"}],
+                        "usage": {"prompt_tokens": 10, "completion_tokens": 2, "total_tokens": 12},
+                    }).encode('utf-8'))
+                else:
+                    lines = [{"response": "mock response", "done": False}, {"response": "", "done": True, "prompt_eval_count": 10, "eval_count": 2}]
+                    self._send(200, "application/x-ndjson", "".join(json.dumps(line) + "\n" for line in lines).encode('utf-8'))
+
+            def _send(self, status, content_type, body):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+def _timed_calls(make_llm, calls):
+    start = time.perf_counter()
+    for index in range(calls):
+        make_llm().invoke(f"Call {index}")
+    return time.perf_counter() - start
+
+def bench_library(proposals, queries):
+    # Filling the library and looking up exemplars for every section as it grows
+    library = ProposalLibrary(":memory:")
+    random_state = random.Random(0)
+    start = time.perf_counter()
+    for index in range(proposals):
+        topics = random_state.sample(RFP_TOPICS, 4)
+        proposal = {section: " ".join(random_state.sample(RFP_TOPICS, 3)) + f" Proposal {index}." for section in REQUIRED_KEYS}
+        library.add(proposal, f"Client {index}", "Software Development", " ".join(topics))
+    elapsed = time.perf_counter() - start
+    print(f"{'add':>10}: {proposals} proposals in {elapsed:7.3f} s ({elapsed / proposals * 1000:.2f} ms each)  {library.stats()['sections']} sections")
+    library.exemplars(REQUIREMENTS, "Software Development")
+    start = time.perf_counter()
+    for _ in range(queries):
+        exemplars = library.exemplars(REQUIREMENTS, "Software Development")
+    elapsed = time.perf_counter() - start
+    best = max((hits[0]["score"] for hits in exemplars.values() if hits), default=0.0)
+    print(f"{'exemplars':>10}: {elapsed / queries * 1000:7.2f} ms per lookup of all sections  (best score {best:.2f})")
+
+def bench_clients(calls, latency):
+    """Connection reuse, rate limiting, retries and fallback against a local mock provider.
+
+    Returns the checks that failed, e.g. a pooled model opening more than one connection.
+    """
+    failures = []
+    # Connection reuse: a model per call with its own connections (the old per-rerun construction)
+    # against models built on the shared pools
+    cases = [
+        ("openai legacy", lambda url: ChatOpenAI(openai_api_base=f"{url}/v1", openai_api_key="x", max_retries=0, cache=False)),
+        ("openai pooled", lambda url: build_llm("OpenAI", "mock", "x", 0.0, cache=False, base_url=f"{url}/v1")),
+        ("ollama legacy", lambda url: Ollama(model="mock", base_url=url, cache=False)),
+        ("ollama pooled", lambda url: build_llm("Ollama", "mock", "", 0.0, cache=False, base_url=url)),
+    ]
+    rate_limits = dict(clients.RATE_LIMITS)
+    clients.RATE_LIMITS.update({"OpenAI": 0, "Ollama": 0})
+    for name, factory in cases:
+        provider = MockProvider(latency=latency)
+        elapsed = _timed_calls(lambda: factory(provider.url), calls)
+        print(f"{name:>16}: {calls} calls in {elapsed:7.3f} s  {provider.connections:3} connections")
+        if name.endswith("pooled") and provider.connections != 1:
+            failures.append(f"{name}: {provider.connections} connections for {calls} calls, expected 1")
+        provider.close()
+    clients.RATE_LIMITS.update(rate_limits)
+
+    # Token bucket: calls to a rate-limited provider are spread out. Ollama is unlimited by
+    # default, so it is checked with the OpenRouter limit unless LLM_RATE_LIMIT_OLLAMA is set.
+    if not clients.RATE_LIMITS["Ollama"]:
+        clients.RATE_LIMITS["Ollama"] = clients.RATE_LIMITS["OpenRouter"]
+    for name, api, factory in [
+        ("openrouter limit", "OpenRouter", lambda url: build_llm("OpenRouter", "mock", "x", 0.0, cache=False, base_url=f"{url}/v1")),
+        ("ollama limit", "Ollama", lambda url: build_llm("Ollama", "mock", "", 0.0, cache=False, base_url=url)),
+    ]:
+        provider = MockProvider(latency=latency)
+        llm = factory(provider.url)
+        elapsed = _timed_calls(lambda: llm, calls)
+        limit = clients.RATE_LIMITS[api]
+        print(f"{name:>16}: {calls} calls in {elapsed:7.3f} s  ({calls / elapsed:.1f}/s, limit {limit:g}/s)")
+        if calls / elapsed > limit * 1.1:
+            failures.append(f"{name}: {calls / elapsed:.1f} requests/s, limit {limit:g}/s")
+        provider.close()
+    clients.RATE_LIMITS.update(rate_limits)
+
+    # Backoff: the first two requests fail with 503 and are retried
+    for name, factory in [
+        ("openai retry", lambda url: build_llm("OpenAI", "mock", "x", 0.0, cache=False, base_url=f"{url}/v1")),
+        ("ollama retry", lambda url: build_llm("Ollama", "mock", "", 0.0, cache=False, base_url=url)),
+    ]:
+        provider = MockProvider(latency=latency, fail_first=2)
+        start = time.perf_counter()
+        result = factory(provider.url).invoke("Retry")
+        print(f"{name:>16}: {message_text(result)!r} after {provider.requests} requests in {time.perf_counter() - start:.3f} s")
+        if message_text(result) != "mock response" or provider.requests != 3:
+            failures.append(f"{name}: {message_text(result)!r} after {provider.requests} requests, expected success on the 3rd")
+        provider.close()
+
+    # Fallback: the primary always fails, so the chain moves on to the next provider
+    primary = MockProvider(latency=latency, always_fail=True, status=500)
+    secondary = MockProvider(latency=latency)
+    llm = build_llm_chain([("OpenAI", "mock", "x"), ("Ollama", "mock", "")], 0.0, cache_for=lambda api: False)
+    llm.runnable.client, llm.runnable.async_client = clients.openai_clients("x", f"{primary.url}/v1")
+    llm.fallbacks[0].base_url = secondary.url
+    start = time.perf_counter()
+    result = llm.invoke("Fallback")
+    print(f"{'fallback':>16}: {message_text(result)!r} in {time.perf_counter() - start:.3f} s "
+          f"(primary {primary.requests} requests, fallback {secondary.requests})")
+    if message_text(result) != "mock response" or not primary.requests or secondary.requests != 1:
+        failures.append(f"fallback: {message_text(result)!r} with {primary.requests} primary and {secondary.requests} fallback requests")
+    primary.close()
+    secondary.close()
+
+    # Streaming through fallbacks still answers repeats from the responding model's cache
+    primary = MockProvider(latency=latency, always_fail=True, status=404)
+    secondary = MockProvider(latency=latency)
+    store = ResponseStore(":memory:")
+    llm = build_llm_chain([("Ollama", "mock-primary", ""), ("Ollama", "mock", "")], 0.0,
+                          cache_for=lambda api: LLMResponseCache(store, api))
+    llm.runnable.base_url, llm.fallbacks[0].base_url = primary.url, secondary.url
+    prompt = PromptTemplate.from_template("{text}")
+    texts = ["".join(stream_text(prompt, llm, {"text": "Cached fallback"})) for _ in range(2)]
+    print(f"{'fallback cache':>16}: {texts[-1]!r} twice with {secondary.requests} fallback requests")
+    if texts != ["mock response"] * 2 or secondary.requests != 1:
+        failures.append(f"fallback cache: {texts!r} with {secondary.requests} fallback requests, expected 1")
+    primary.close()
+    secondary.close()
+    return failures
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+# Modules the app must not load until a stage needs them; loading any while rendering the empty page fails `startup`
+LAZY_MODULES = [
+    "langchain", "langchain_community", "langchain_core.runnables.base", "openai", "httpx", "aiohttp",
+    "fitz", "openpyxl", "docx", "ddgs", "duckduckgo_search", "stages", "generation", "improve",
+]
+FIRST_RENDER_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+AppTest.from_file({script!r}, default_timeout=120).run()
+print(json.dumps({{"seconds": time.perf_counter() - start, "modules": sorted(sys.modules)}}))
+"""
+
+def parse_importtime(stderr):
+    # (name, self seconds, cumulative seconds, depth) for each line of `python -X importtime` output
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((name.strip(), int(self_us) / 1e6, int(cumulative_us) / 1e6, depth))
+    return rows
+
+def run_startup(repeat):
+    """Cold ``import main`` and first page render, each in a fresh interpreter ``repeat`` times."""
+    import_times, render_times = [], []
+    for _ in range(repeat):
+        process = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"],
+                                 cwd=APP_DIR, capture_output=True, text=True, check=True)
+        rows = parse_importtime(process.stderr)
+        main_index = next(index for index, row in enumerate(rows) if row[0] == "main" and row[3] == 0)
+        import_times.append(rows[main_index][2])
+
+        script = FIRST_RENDER_SCRIPT.format(script=os.path.join(APP_DIR, "main.py"))
+        process = subprocess.run([sys.executable, "-c", script], cwd=APP_DIR, capture_output=True, text=True, check=True)
+        render = json.loads(process.stdout.strip().splitlines()[-1])
+        render_times.append(render["seconds"])
+
+    # Direct imports of main from the last run are the ones printed after the previous top-level import
+    start = max((index for index, row in enumerate(rows[:main_index]) if row[3] == 0), default=-1) + 1
+    slowest = sorted((row for row in rows[start:main_index] if row[3] == 1), key=lambda row: -row[2])[:8]
+    print("Slowest imports of main.py: " + ", ".join(f"{name} {cumulative * 1000:.0f} ms" for name, _, cumulative, _ in slowest))
+    loaded = [name for name in LAZY_MODULES if name in render["modules"]]
+    return {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {"repeat": repeat},
+        "scenarios": {
+            name: {"median": statistics.median(timings), "min": min(timings), "runs": len(timings), "peak_mb": None}
+            for name, timings in [("startup/import", import_times), ("startup/first_render", render_times)]
+        },
+        "eager_modules": loaded,
+    }
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_suite(sizes, scenarios, repeat, warmup, **settings):
+    suite = Suite(**settings)
+    results = {}
+    for size in sizes:
+        files = make_fixtures(size)
+        documents = extract_texts(files)
+        print(f"Fixtures ({size}): " + ", ".join(f"{file.name} {len(file.data) / 1024:.0f} KB" for file in files))
+        for name in scenarios:
+            func = getattr(suite, name)
+            for _ in range(warmup):
+                func(files, documents)
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                func(files, documents)
+                timings.append(time.perf_counter() - start)
+            # Peak memory from one extra run, since tracing allocations slows the timed ones down
+            _, _, peak = measure(func, files, documents)
+            results[f"{name}/{size}"] = {
+                "median": statistics.median(timings),
+                "min": min(timings),
+                "runs": len(timings),
+                "peak_mb": peak / (1024 * 1024),
+            }
+            print(f"{name + '/' + size:>30}: median {statistics.median(timings):8.4f} s  min {min(timings):8.4f} s  peak {peak / (1024 * 1024):7.1f} MB")
+    return {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": dict(suite.settings, repeat=repeat),
+        "scenarios": results,
+    }
+
+def save_results(results, results_dir=RESULTS_DIR):
+    os.makedirs(results_dir, exist_ok=True)
+    name = datetime.datetime.now().strftime("%Y%m%d-%H%M%S") + (f"-{results['commit']}" if results["commit"] else "")
+    path = os.path.join(results_dir, f"{name}.json")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    return path
+
+def compare_results(baseline, current, threshold=0.25, min_delta=0.005):
+    """Scenarios whose median time grew by more than ``threshold`` (a fraction) over the baseline.
+
+    Differences under ``min_delta`` seconds are ignored, so fast scenarios don't fail on noise.
+    """
+    if baseline.get("settings") != current.get("settings"):
+        print(f"Warning: settings differ from the baseline ({baseline.get('settings')} vs {current.get('settings')})")
+    regressions = []
+    for name, result in current["scenarios"].items():
+        previous = baseline["scenarios"].get(name)
+        if previous is None:
+            continue
+        change = result["median"] / previous["median"] - 1 if previous["median"] else 0.0
+        regressed = change > threshold and result["median"] - previous["median"] > min_delta
+        print(f"{name:>30}: {previous['median']:8.4f} s -> {result['median']:8.4f} s  {change:+7.1%}{'  REGRESSION' if regressed else ''}")
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+def load_results(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def main():
+    parser = argparse.ArgumentParser(description="Performance benchmarks for the proposal generator")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    suite_parser = subparsers.add_parser("suite", help="Offline end-to-end scenarios against a fake model and search")
+    suite_parser.add_argument("--sizes", nargs="+", choices=list(FIXTURE_SIZES), default=list(FIXTURE_SIZES))
+    suite_parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    suite_parser.add_argument("--repeat", type=int, default=5)
+    suite_parser.add_argument("--warmup", type=int, default=1)
+    suite_parser.add_argument("--llm-latency", type=float, default=0.0, help="Seconds before the fake model's first token")
+    suite_parser.add_argument("--token-latency", type=float, default=0.0, help="Seconds between the fake model's streamed tokens")
+    suite_parser.add_argument("--search-latency", type=float, default=0.0, help="Seconds per fake search")
+    suite_parser.add_argument("--results-dir", default=RESULTS_DIR)
+    suite_parser.add_argument("--baseline", help="Results file to compare against; exits non-zero on regression")
+    suite_parser.add_argument("--threshold", type=float, default=0.25, help="Allowed slowdown as a fraction of the baseline median")
+
+    clients_parser = subparsers.add_parser("clients", help="Connection reuse, rate limiting, retries and fallback against a local mock server")
+    clients_parser.add_argument("--calls", type=int, default=10)
+    clients_parser.add_argument("--latency", type=float, default=0.01, help="Seconds the mock server takes per request")
+
+    library_parser = subparsers.add_parser("library", help="Proposal library storage and exemplar lookup")
+    library_parser.add_argument("--proposals", type=int, default=1000)
+    library_parser.add_argument("--queries", type=int, default=20)
+
+    startup_parser = subparsers.add_parser("startup", help="Cold import and first render of the app (uses -X importtime)")
+    startup_parser.add_argument("--repeat", type=int, default=5)
+    startup_parser.add_argument("--results-dir", default=RESULTS_DIR)
+    startup_parser.add_argument("--baseline", help="Results file to compare against; exits non-zero on regression")
+    startup_parser.add_argument("--threshold", type=float, default=0.25, help="Allowed slowdown as a fraction of the baseline median")
+
+    compare_parser = subparsers.add_parser("compare", help="Compare two stored suite results")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.25)
+
+    xlsx_parser = subparsers.add_parser("xlsx", help="Full vs streaming XLSX extraction")
+    xlsx_parser.add_argument("--rows", type=int, default=20000)
+    xlsx_parser.add_argument("--cols", type=int, default=10)
+    xlsx_parser.add_argument("--sheets", type=int, default=1)
+
+    docx_parser = subparsers.add_parser("docx", help="Save/reload/save vs single-pass DOCX rendering")
+    docx_parser.add_argument("--paragraphs", type=int, default=200, help="Lines of text per proposal section")
+    docx_parser.add_argument("--repeat", type=int, default=3)
+
+    args = parser.parse_args()
+    if args.benchmark == "suite":
+        results = run_suite(
+            args.sizes, args.scenarios, args.repeat, args.warmup,
+            llm_latency=args.llm_latency, token_latency=args.token_latency, search_latency=args.search_latency
+        )
+        print(f"Results saved to {save_results(results, args.results_dir)}")
+        if args.baseline and compare_results(load_results(args.baseline), results, args.threshold):
+            sys.exit(1)
+    elif args.benchmark == "clients":
+        failures = bench_clients(args.calls, args.latency)
+        for failure in failures:
+            print(f"FAILED {failure}")
+        if failures:
+            sys.exit(1)
+    elif args.benchmark == "library":
+        bench_library(args.proposals, args.queries)
+    elif args.benchmark == "startup":
+        results = run_startup(args.repeat)
+        for name, result in results["scenarios"].items():
+            print(f"{name:>30}: median {result['median']:8.4f} s  min {result['min']:8.4f} s")
+        print(f"Results saved to {save_results(results, args.results_dir)}")
+        failed = False
+        if results["eager_modules"]:
+            print(f"Loaded before any stage needs them: {', '.join(results['eager_modules'])}")
+            failed = True
+        if args.baseline and compare_results(load_results(args.baseline), results, args.threshold):
+            failed = True
+        if failed:
+            sys.exit(1)
+    elif args.benchmark == "compare":
+        if compare_results(load_results(args.baseline), load_results(args.current), args.threshold):
+            sys.exit(1)
+    elif args.benchmark == "xlsx":
+        bench_xlsx(args.rows, args.cols, args.sheets)
+    elif args.benchmark == "docx":
+        bench_docx(args.paragraphs, args.repeat)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""Shared HTTP plumbing for LLM providers: pooled connections, rate limits, timeouts and retries.
+
+Every model built by ``config.build_llm`` goes through here, so all clients in the
+process share a small set of keep-alive connection pools instead of opening new
+connections per Streamlit rerun, and calls to a provider draw from one token bucket.
+"""
+import json
+import os
+import threading
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from langchain_community.chat_models import ChatOpenAI
+from langchain_community.llms import Ollama
+from langchain_community.llms.ollama import OllamaEndpointNotFoundError
+from langchain_core.rate_limiters import InMemoryRateLimiter
+
+REQUEST_TIMEOUT = float(os.environ.get("LLM_REQUEST_TIMEOUT", 120))
+# Retries with exponential backoff on connection errors, 429 and 5xx responses
+MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", 3))
+MAX_CONNECTIONS = int(os.environ.get("LLM_MAX_CONNECTIONS", 20))
+OLLAMA_BASE_URL = os.environ.get("OLLAMA_BASE_URL", "http://localhost:11434")
+OPENROUTER_BASE_URL = os.environ.get("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
+# Requests per second allowed per provider; 0 disables limiting (e.g. for a local Ollama)
+RATE_LIMITS = {
+    "OpenAI": float(os.environ.get("LLM_RATE_LIMIT_OPENAI", 5)),
+    "OpenRouter": float(os.environ.get("LLM_RATE_LIMIT_OPENROUTER", 2)),
+    "Ollama": float(os.environ.get("LLM_RATE_LIMIT_OLLAMA", 0)),
+}
+
+_lock = threading.Lock()
+_http_client = None
+_async_http_client = None
+_session = None
+_rate_limiters = {}
+
+def _limits():
+    return httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_CONNECTIONS)
+
+def get_http_client():
+    global _http_client
+    with _lock:
+        if _http_client is None:
+            _http_client = httpx.Client(limits=_limits(), timeout=REQUEST_TIMEOUT)
+        return _http_client
+
+def get_async_http_client():
+    global _async_http_client
+    with _lock:
+        if _async_http_client is None:
+            _async_http_client = httpx.AsyncClient(limits=_limits(), timeout=REQUEST_TIMEOUT)
+        return _async_http_client
+
+def get_session():
+    # requests session for Ollama; urllib3 retries connection errors and 5xx with backoff
+    global _session
+    with _lock:
+        if _session is None:
+            retry = Retry(
+                total=MAX_RETRIES,
+                backoff_factor=0.5,
+                status_forcelist=(429, 500, 502, 503, 504),
+                allowed_methods=None,
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=MAX_CONNECTIONS, max_retries=retry)
+            _session = requests.Session()
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+        return _session
+
+def get_rate_limiter(provider):
+    # One token bucket per provider, shared by every model built for it
+    requests_per_second = RATE_LIMITS.get(provider, 0)
+    if requests_per_second <= 0:
+        return None
+    with _lock:
+        if provider not in _rate_limiters:
+            _rate_limiters[provider] = InMemoryRateLimiter(
+                requests_per_second=requests_per_second,
+                check_every_n_seconds=0.05,
+                max_bucket_size=max(1, requests_per_second),
+            )
+        return _rate_limiters[provider]
+
+def openai_clients(api_key, base_url=None):
+    # Chat-completions clients on the shared pools; the SDK retries with exponential backoff
+    import openai
+    params = {
+        "api_key": api_key or "not-needed",
+        "base_url": base_url,
+        "timeout": REQUEST_TIMEOUT,
+        "max_retries": MAX_RETRIES,
+    }
+    return (
+        openai.OpenAI(http_client=get_http_client(), **params).chat.completions,
+        openai.AsyncOpenAI(http_client=get_async_http_client(), **params).chat.completions,
+    )
+
+class ChatOpenRouter(ChatOpenAI):
+    """OpenRouter's OpenAI-compatible chat API."""
+
+    openai_api_base: str = OPENROUTER_BASE_URL
+
+class PooledOllama(Ollama):
+    """Ollama completion model sending its requests through the shared session.
+
+    The community client calls ``requests.post`` per request, which opens a new
+    connection each time and never retries. Completion models take no ``rate_limiter``,
+    so the Ollama token bucket is applied here too.
+    """
+
+    def _create_stream(self, api_url, payload, stop=None, **kwargs):
+        if self.stop is not None and stop is not None:
+            raise ValueError("`stop` found in both the input and default params.")
+        stop = self.stop if self.stop is not None else stop
+
+        params = self._default_params
+        for key in self._default_params:
+            if key in kwargs:
+                params[key] = kwargs[key]
+        if "options" in kwargs:
+            params["options"] = kwargs["options"]
+        else:
+            params["options"] = {
+                **params["options"],
+                "stop": stop,
+                **{k: v for k, v in kwargs.items() if k not in self._default_params},
+            }
+        if payload.get("messages"):
+            request_payload = {"messages": payload.get("messages", []), **params}
+        else:
+            request_payload = {"prompt": payload.get("prompt"), "images": payload.get("images", []), **params}
+
+        rate_limiter = get_rate_limiter("Ollama")
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        response = get_session().post(
+            url=api_url,
+            headers={"Content-Type": "application/json", **(self.headers if isinstance(self.headers, dict) else {})},
+            auth=self.auth,
+            data=json.dumps(request_payload),
+            stream=True,
+            timeout=self.timeout,
+        )
+        response.encoding = "utf-8"
+        if response.status_code == 404:
+            raise OllamaEndpointNotFoundError(
+                f"Ollama call failed with status code 404. Maybe your model is not found "
+                f"and you should pull the model with `ollama pull {self.model}`."
+            )
+        if response.status_code != 200:
+            raise ValueError(f"Ollama call failed with status code {response.status_code}. Details: {response.text}")
+        return response.iter_lines(decode_unicode=True)
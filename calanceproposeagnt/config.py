@@ -1,15 +1,97 @@
-from langchain_community.chat_models import ChatOpenAI
-from langchain_community.llms import Ollama
+import os
 import streamlit as st
+from tracing import get_llm_metrics_handler
 
-def configure_llm(api, api_key, temp):
+# Tokens of document and research context packed into the generation prompt, per model.
+# Kept well under each model's window to leave room for the template and the JSON completion.
+MODEL_CONTEXT_BUDGETS = {
+    'llama3.1:latest': 12000,
+    'mistral': 6000,
+    'gemma2': 4000,
+    'openai/gpt-4o-mini': 60000,
+    'anthropic/claude-3.5-sonnet': 80000,
+    'meta-llama/llama-3.1-8b-instruct:free': 12000,
+    'meta-llama/llama-3.1-70b-instruct': 60000,
+    'gpt-4': 4000,
+    'gpt-3.5-turbo': 8000,
+}
+DEFAULT_CONTEXT_BUDGET = 4000
+# Model calls in flight at once when sections are written or improved separately
+DEFAULT_MAX_CONCURRENCY = 4
+DEFAULT_SECTION_RETRIES = 2
+
+def get_context_budget(model_name):
+    return MODEL_CONTEXT_BUDGETS.get(model_name, DEFAULT_CONTEXT_BUDGET)
+
+MODEL_CHOICES = {
+    'Ollama': ['llama3.1:latest', 'mistral', 'gemma2'],
+    'OpenRouter': ['openai/gpt-4o-mini', 'anthropic/claude-3.5-sonnet', 'meta-llama/llama-3.1-8b-instruct:free','meta-llama/llama-3.1-70b-instruct'],
+    'OpenAI': ['gpt-4', 'gpt-3.5-turbo'],
+}
+# Offline, deterministic model for demos and benchmarks (see fakes.py); hidden unless enabled
+if os.environ.get("ENABLE_FAKE_LLM"):
+    MODEL_CHOICES['Fake'] = ['fake']
+
+def build_llm(api, model, api_key, temp, cache=None, base_url=None):
+    # cache: a LangChain BaseCache for responses, False to bypass caching, None for the global default.
+    # base_url overrides the provider's endpoint, e.g. for a proxy or a local mock server.
+    # Provider clients are imported on first use; they are the slowest part of starting the app
+    from clients import (MAX_RETRIES, OLLAMA_BASE_URL, OPENROUTER_BASE_URL, REQUEST_TIMEOUT, ChatOpenRouter,
+                         PooledOllama, get_rate_limiter, openai_clients)
+    from langchain_community.chat_models import ChatOpenAI
+    callbacks = [get_llm_metrics_handler()]
     if api == 'Ollama':
-        model = st.sidebar.selectbox('Choose a model', ['llama3.1:latest', 'mistral', 'gemma2'])
-        return Ollama(model=model, temperature=temp, base_url="http://localhost:11434")
-    elif api == 'OpenRouter':
-        model = st.sidebar.selectbox('Choose a model', ['openai/gpt-4o-mini', 'anthropic/claude-3.5-sonnet', 'meta-llama/llama-3.1-8b-instruct:free','meta-llama/llama-3.1-70b-instruct'])
-        return ChatOpenRouter(model_name=model, temperature=temp, openai_api_key=api_key)
-    elif api == 'OpenAI':
-        model = st.sidebar.selectbox('Choose a model', ['gpt-4', 'gpt-3.5-turbo'])
-        return ChatOpenAI(temperature=temp, openai_api_key=api_key, model_name=model)
+        return PooledOllama(model=model, temperature=temp, base_url=base_url or OLLAMA_BASE_URL,
+                            timeout=REQUEST_TIMEOUT, cache=cache, callbacks=callbacks)
+    elif api in ('OpenRouter', 'OpenAI'):
+        model_class = ChatOpenRouter if api == 'OpenRouter' else ChatOpenAI
+        base_url = base_url or (OPENROUTER_BASE_URL if api == 'OpenRouter' else None)
+        client, async_client = openai_clients(api_key, base_url)
+        return model_class(
+            model_name=model, temperature=temp, openai_api_key=api_key or "not-needed", openai_api_base=base_url,
+            client=client, async_client=async_client, request_timeout=REQUEST_TIMEOUT, max_retries=MAX_RETRIES,
+            rate_limiter=get_rate_limiter(api), cache=cache, callbacks=callbacks
+        )
+    elif api == 'Fake':
+        from fakes import FakeChatModel
+        return FakeChatModel(model_name=model, cache=cache, callbacks=callbacks)
     return None
+
+def build_llm_chain(providers, temp, cache_for=None):
+    """The first provider's model, falling back to the next ones in order when a call fails.
+
+    ``providers`` is a list of ``(api, model, api_key)``; ``cache_for(api)`` returns the
+    response cache for a provider. Timeouts and exhausted retries count as failures,
+    so a slow or failing provider hands over to the next.
+    """
+    models = [build_llm(api, model, api_key, temp, cache=cache_for(api) if cache_for else None)
+              for api, model, api_key in providers]
+    if len(models) == 1:
+        return models[0]
+    return models[0].with_fallbacks(models[1:])
+
+@st.cache_resource(show_spinner=False, max_entries=16)
+def get_llm(providers, temp, refresh=False):
+    # One client per configuration for the life of the server, instead of one per rerun
+    from llm_cache import get_response_cache
+    return build_llm_chain(list(providers), temp, cache_for=lambda api: get_response_cache(api, refresh=refresh))
+
+def configure_providers(api, api_key):
+    """Sidebar choice of model and fallbacks, as a tuple of ``(api, model, api_key)`` for ``get_llm``.
+
+    Nothing is built here, so rendering the page doesn't load any provider client;
+    stages call ``get_llm`` when they need the model. Returns None for an unknown API.
+    """
+    if api not in MODEL_CHOICES:
+        return None
+    model = st.sidebar.selectbox('Choose a model', MODEL_CHOICES[api])
+    fallbacks = st.sidebar.multiselect(
+        'Fallback providers',
+        [other for other in MODEL_CHOICES if other != api],
+        help='Tried in order with their default model when the chosen provider fails or times out. '
+             'API keys for fallbacks are read from OPENAI_API_KEY / OPENROUTER_API_KEY.'
+    )
+    providers = [(api, model, api_key)] + [
+        (other, MODEL_CHOICES[other][0], os.environ.get(f"{other.upper()}_API_KEY", "")) for other in fallbacks
+    ]
+    return tuple(providers)
@@ -0,0 +1,148 @@
+import hashlib
+import logging
+import os
+import re
+import tempfile
+from collections import Counter
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken is optional; fall back to a character-based estimate
+    tiktoken = None
+
+CHUNK_TOKENS = 400
+# tiktoken downloads its encoding on first use unless it is already cached locally. Offline
+# that stalls the first proposal on connection retries, so downloading is opt-in.
+TIKTOKEN_DOWNLOAD = bool(os.environ.get("TIKTOKEN_DOWNLOAD"))
+CL100K_BASE_URL = "https://openaipublic.blob.core.windows.net/encodings/cl100k_base.tiktoken"
+WORD_RE = re.compile(r"[a-z0-9]+")
+# Very common words carry no signal about relevance to the requirements
+STOPWORDS = frozenset("""
+a an and are as at be by for from has have in is it its of on or that the this to was were will with
+we you your our their they should must shall can may not all any each such which who what when where
+""".split())
+
+def _encoding_cached():
+    # Same location tiktoken reads its cached download from
+    cache_dir = os.environ.get("TIKTOKEN_CACHE_DIR", os.environ.get("DATA_GYM_CACHE_DIR", os.path.join(tempfile.gettempdir(), "data-gym-cache")))
+    return bool(cache_dir) and os.path.exists(os.path.join(cache_dir, hashlib.sha1(CL100K_BASE_URL.encode()).hexdigest()))
+
+@lru_cache(maxsize=1)
+def _encoding():
+    if tiktoken is None:
+        return None
+    if not (TIKTOKEN_DOWNLOAD or _encoding_cached()):
+        logging.info("tiktoken encoding not cached locally, estimating token counts (set TIKTOKEN_DOWNLOAD=1 to fetch it)")
+        return None
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        logging.warning(f"tiktoken unavailable, estimating token counts: {str(e)}")
+        return None
+
+def count_tokens(text):
+    encoding = _encoding()
+    if encoding is None:
+        return max(1, len(text) // 4) if text else 0
+    return len(encoding.encode(text, disallowed_special=()))
+
+def get_model_name(llm):
+    # A model with fallbacks is named after its primary model
+    llm = getattr(llm, 'runnable', llm)
+    return getattr(llm, 'model_name', None) or getattr(llm, 'model', None)
+
+def tokenize(text):
+    return [word for word in WORD_RE.findall(text.lower()) if word not in STOPWORDS and len(word) > 2]
+
+def chunk_text(text, chunk_tokens=CHUNK_TOKENS):
+    # Group paragraphs into chunks of roughly chunk_tokens; oversized paragraphs are split on lines
+    pieces = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        if count_tokens(paragraph) > chunk_tokens:
+            for line in paragraph.split("\n"):
+                # Lines with no breaks at all (e.g. flattened PDF text) are cut by character count
+                step = chunk_tokens * 4
+                pieces.extend(line[i:i + step] for i in range(0, len(line), step))
+        else:
+            pieces.append(paragraph)
+
+    chunks, current, current_tokens = [], [], 0
+    for piece in pieces:
+        if not piece.strip():
+            continue
+        piece_tokens = count_tokens(piece)
+        if current and current_tokens + piece_tokens > chunk_tokens:
+            chunks.append("\n\n".join(current))
+            current, current_tokens = [], 0
+        current.append(piece)
+        current_tokens += piece_tokens
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+def score_chunk(chunk_terms, query_terms):
+    # Term-overlap score normalised by chunk length so long chunks don't win by size alone
+    if not chunk_terms or not query_terms:
+        return 0.0
+    counts = Counter(chunk_terms)
+    overlap = sum(min(counts[term], 3) * weight for term, weight in query_terms.items() if term in counts)
+    return overlap / (len(chunk_terms) ** 0.5)
+
+def assemble_context(requirements, sources, budget, chunk_tokens=CHUNK_TOKENS, scorer=None, min_score=None):
+    """Pack the most relevant chunks of ``sources`` into ``budget`` tokens.
+
+    ``sources`` is a list of ``(source_name, text)`` pairs. Chunks are ranked by
+    ``scorer(chunk_text) -> float`` (term overlap with ``requirements`` by default)
+    and greedily packed; the selected chunks are emitted in their original order.
+    Chunks scoring below ``min_score`` are dropped regardless of the budget.
+    Returns a dict with the assembled ``text`` and the ``included``/``dropped`` chunks.
+    """
+    if scorer is None:
+        query_terms = Counter(tokenize(requirements))
+        scorer = lambda chunk: score_chunk(tokenize(chunk), query_terms)
+
+    candidates = []
+    for source_index, (source_name, text) in enumerate(sources):
+        for chunk_index, chunk in enumerate(chunk_text(text, chunk_tokens)):
+            candidates.append({
+                "source": source_name,
+                "source_index": source_index,
+                "chunk_index": chunk_index,
+                "text": chunk,
+                "tokens": count_tokens(chunk),
+                "score": scorer(chunk),
+            })
+
+    used = 0
+    included, dropped = [], []
+    included_sources = set()
+    for candidate in sorted(candidates, key=lambda c: (-c["score"], c["source_index"], c["chunk_index"])):
+        # Each source gets a header line the first time one of its chunks is included
+        header_tokens = 0 if candidate["source"] in included_sources else count_tokens(candidate["source"]) + 4
+        if min_score is not None and candidate["score"] < min_score:
+            dropped.append(candidate)
+        elif used + candidate["tokens"] + header_tokens <= budget:
+            included.append(candidate)
+            included_sources.add(candidate["source"])
+            used += candidate["tokens"] + header_tokens
+        else:
+            dropped.append(candidate)
+
+    parts = []
+    current_source = None
+    for candidate in sorted(included, key=lambda c: (c["source_index"], c["chunk_index"])):
+        if candidate["source"] != current_source:
+            current_source = candidate["source"]
+            parts.append(f"Content from {current_source}:")
+        parts.append(candidate["text"])
+
+    if dropped:
+        logging.info(f"Context assembly dropped {len(dropped)} chunks ({sum(c['tokens'] for c in dropped)} tokens) to fit a budget of {budget} tokens")
+    return {
+        "text": "\n\n".join(parts),
+        "tokens": used,
+        "budget": budget,
+        "included": [{k: c[k] for k in ("source", "chunk_index", "tokens", "score")} for c in included],
+        "dropped": [{k: c[k] for k in ("source", "chunk_index", "tokens", "score")} for c in dropped],
+    }
@@ -1,12 +1,33 @@
 from docx import Document
-from docx.shared import Inches
 from docx.enum.style import WD_STYLE_TYPE
 from docx.shared import Pt
+from docx.oxml import OxmlElement
+from docx.oxml.ns import qn
+import io
 import logging
 import datetime
+import os
+import threading
+import zipfile
+from tracing import span
+
+# Optional branded .docx/.dotx whose styles, headers and letterhead every proposal starts from
+TEMPLATE_PATH = os.environ.get("DOCX_TEMPLATE_PATH")
+
+TERMS = [
+    'The pricing in this SOW is valid for 30 days from the date of submission.',
+    'Professional fees will be invoiced monthly based on actual time & materials effort.',
+    'We do not anticipate travel for this project.'
+]
+CLIENT_LINE = "Client: {client_name}"
 
 def add_custom_styles(doc):
-    # Add a custom style for TOC entries
+    # Add a custom style for TOC entries, unless the document (e.g. a branded template) already has one
+    try:
+        doc.styles['TOC 1']
+        return
+    except KeyError:
+        pass
     style = doc.styles.add_style('TOC 1', WD_STYLE_TYPE.PARAGRAPH)
     style.font.name = 'Arial'
     style.font.size = Pt(12)
@@ -14,12 +35,136 @@ def add_custom_styles(doc):
     style.paragraph_format.space_after = Pt(6)
     style.paragraph_format.left_indent = Pt(12)
 
-def generate_docx(proposal_content, client_name):
-    doc = Document()
-    
-    # Add custom styles
-    add_custom_styles(doc)
-    
+def style_or_default(doc, name):
+    # Branded templates don't always define the built-in styles python-docx's default template has
+    try:
+        return doc.styles[name]
+    except KeyError:
+        logging.warning(f"Style '{name}' not found in template, using the default paragraph style")
+        return None
+
+def add_heading(doc, text, level=1):
+    # doc.add_heading fails outright when the template lacks the heading style
+    return doc.add_paragraph(text, style=style_or_default(doc, 'Title' if level == 0 else f'Heading {level}'))
+
+def add_field(paragraph, instruction):
+    # Word fills field codes such as PAGE and NUMPAGES when the document is laid out,
+    # so the real page numbers appear without measuring anything here
+    run = paragraph.add_run()
+    begin = OxmlElement('w:fldChar')
+    begin.set(qn('w:fldCharType'), 'begin')
+    instr = OxmlElement('w:instrText')
+    instr.set(qn('xml:space'), 'preserve')
+    instr.text = f" {instruction} "
+    separate = OxmlElement('w:fldChar')
+    separate.set(qn('w:fldCharType'), 'separate')
+    placeholder = OxmlElement('w:t')
+    placeholder.text = "1"
+    end = OxmlElement('w:fldChar')
+    end.set(qn('w:fldCharType'), 'end')
+    for element in (begin, instr, separate, placeholder, end):
+        run._r.append(element)
+    return run
+
+def add_page_number_footer(paragraph):
+    paragraph.text = "Page "
+    add_field(paragraph, "PAGE")
+    paragraph.add_run(" of ")
+    add_field(paragraph, "NUMPAGES")
+
+def read_template_bytes(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    if not path.lower().endswith('.dotx'):
+        return data
+    # python-docx only opens documents, so relabel the template's main part as a document
+    source = zipfile.ZipFile(io.BytesIO(data))
+    output = io.BytesIO()
+    with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as target:
+        for item in source.infolist():
+            content = source.read(item.filename)
+            if item.filename == '[Content_Types].xml':
+                content = content.replace(
+                    b'application/vnd.openxmlformats-officedocument.wordprocessingml.template.main+xml',
+                    b'application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml'
+                )
+            target.writestr(item, content)
+    return output.getvalue()
+
+def add_boilerplate(doc):
+    # Terms and signature blocks are identical for every proposal apart from the client line
+    add_heading(doc, 'Terms and Conditions', level=1)
+    for term in TERMS:
+        doc.add_paragraph(term, style=style_or_default(doc, 'List Bullet'))
+
+    # Add Signatures / Work Authorization
+    add_heading(doc, 'Signatures / Work Authorization', level=1)
+    doc.add_paragraph('IN WITNESS WHEREOF, and in acknowledgment that the parties hereto have read and understood each and every provision hereof, the parties have executed this Statement of Work.')
+
+    # Add signature lines
+    doc.add_paragraph(CLIENT_LINE)
+    doc.add_paragraph("By: ________________________________")
+    doc.add_paragraph("Name: ______________________________")
+    doc.add_paragraph("Title: _______________________________")
+    doc.add_paragraph("Date: _______________________________")
+
+    doc.add_paragraph("Vendor: Partners Information Technology, Inc. dba Calance")
+    doc.add_paragraph("By: ________________________________")
+    doc.add_paragraph("Name: Asit Govil")
+    doc.add_paragraph("Title: COO")
+    doc.add_paragraph("Date: _______________________________")
+
+def _body_elements(doc):
+    # Block-level body children, excluding the trailing section properties
+    return [element for element in doc.element.body if element.tag != qn('w:sectPr')]
+
+class BaseTemplate:
+    """A pre-styled base document with the static boilerplate already laid out.
+
+    The prepared package is kept in memory, so each proposal opens it from bytes
+    instead of re-reading the template file, adding styles and rebuilding the terms
+    and signature blocks. (python-docx objects can't be deep-copied safely: lxml
+    copies each element tree separately, so parts lose track of each other.)
+    """
+
+    def __init__(self, path=None):
+        self.branded = path is not None
+        doc = Document(io.BytesIO(read_template_bytes(path))) if path else Document()
+        add_custom_styles(doc)
+        self.body_count = len(_body_elements(doc))
+        add_boilerplate(doc)
+        data = io.BytesIO()
+        doc.save(data)
+        self.data = data.getvalue()
+
+    def clone(self):
+        doc = Document(io.BytesIO(self.data))
+        body = doc.element.body
+        # Detach the boilerplate so variable content can be added with the normal API,
+        # then put it back at the end
+        boilerplate = _body_elements(doc)[self.body_count:]
+        for element in boilerplate:
+            body.remove(element)
+        return doc, boilerplate
+
+_templates = {}
+_templates_lock = threading.Lock()
+
+def get_base_template(path=None):
+    # Cached per path and modification time, so editing the template file takes effect
+    key = (path, os.path.getmtime(path) if path else None)
+    with _templates_lock:
+        template = _templates.get(key)
+        if template is None:
+            template = BaseTemplate(path)
+            _templates.clear()
+            _templates[key] = template
+        return template
+
+def generate_docx(proposal_content, client_name, template_path=None):
+    template = get_base_template(template_path or TEMPLATE_PATH)
+    doc, boilerplate = template.clone()
+
     # Add default date if missing
     current_date = datetime.date.today().strftime("%Y-%m-%d")
     proposal_date = proposal_content.get("date", current_date)
@@ -33,17 +178,17 @@ def generate_docx(proposal_content, client_name):
 
     # Add a title with error handling
     try:
-        doc.add_heading(f'SOW {proposal_date} {project_name} for {client_name}', 0)
+        add_heading(doc, f'SOW {proposal_date} {project_name} for {client_name}', level=0)
     except Exception as e:
         logging.error(f"Error adding heading: {str(e)}")
-        doc.add_heading(f'SOW for {client_name}', 0)
+        add_heading(doc, f'SOW for {client_name}', level=0)
 
     # Add Calance information
     doc.add_paragraph('Calance\n888 Disneyland Drive Suite 500\nAnaheim, CA 92802')
 
     # Add a table for date, services performed by, and services performed for
     table = doc.add_table(rows=2, cols=3)
-    table.style = 'Table Grid'
+    table.style = style_or_default(doc, 'Table Grid')
     hdr_cells = table.rows[0].cells
     hdr_cells[0].text = 'Date'
     hdr_cells[1].text = 'Services Performed By:'
@@ -54,7 +199,7 @@ def generate_docx(proposal_content, client_name):
     row_cells[2].text = f"{client_name}\n[Client Address]\n[City, ST ZIP Code]"
 
     # Add table of contents
-    doc.add_heading('Table of Contents', level=1)
+    add_heading(doc, 'Table of Contents', level=1)
     for section in proposal_content.keys():
         if section not in ['date', 'project_name']:
             doc.add_paragraph(section.replace('_', ' ').title(), style='TOC 1')
@@ -62,44 +207,42 @@ def generate_docx(proposal_content, client_name):
     # Add sections from the proposal content with error handling
     for section in ['description', 'purpose', 'scope', 'approach', 'engagement_approach', 'project_estimated_timeline', 'development_hosting_support_maintenance_estimates', 'risks_constraints_dependencies']:
         try:
-            doc.add_heading(section.replace('_', ' ').title(), level=1)
+            add_heading(doc, section.replace('_', ' ').title(), level=1)
             content = proposal_content.get(section, "Not provided")
             doc.add_paragraph(str(content))
         except Exception as e:
             logging.error(f"Error adding section {section}: {str(e)}")
 
-    # Add Terms and Conditions
-    doc.add_heading('Terms and Conditions', level=1)
-    terms = [
-        'The pricing in this SOW is valid for 30 days from the date of submission.',
-        'Professional fees will be invoiced monthly based on actual time & materials effort.',
-        'We do not anticipate travel for this project.'
-    ]
-    for term in terms:
-        doc.add_paragraph(term, style='ListBullet')
-
-    # Add Signatures / Work Authorization
-    doc.add_heading('Signatures / Work Authorization', level=1)
-    doc.add_paragraph('IN WITNESS WHEREOF, and in acknowledgment that the parties hereto have read and understood each and every provision hereof, the parties have executed this Statement of Work.')
-
-    # Add signature lines
-    doc.add_paragraph(f"Client: {client_name}")
-    doc.add_paragraph("By: ________________________________")
-    doc.add_paragraph("Name: ______________________________")
-    doc.add_paragraph("Title: _______________________________")
-    doc.add_paragraph("Date: _______________________________")
-
-    doc.add_paragraph("Vendor: Partners Information Technology, Inc. dba Calance")
-    doc.add_paragraph("By: ________________________________")
-    doc.add_paragraph("Name: Asit Govil")
-    doc.add_paragraph("Title: COO")
-    doc.add_paragraph("Date: _______________________________")
+    # Re-attach the pre-built terms and signature blocks, filling in the client
+    sect_pr = doc.element.body.sectPr
+    for element in boilerplate:
+        if sect_pr is not None:
+            sect_pr.addprevious(element)
+        else:
+            doc.element.body.append(element)
+    for paragraph in doc.paragraphs[-len(boilerplate):]:
+        if paragraph.text == CLIENT_LINE:
+            paragraph.text = CLIENT_LINE.format(client_name=client_name)
+            break
 
-    # Add headers and footers
+    # Add headers and footers; a branded template's own header/footer content is kept
     section = doc.sections[0]
     header = section.header
-    header.paragraphs[0].text = f"SOW for {client_name}"
-    footer = section.footer
-    footer.paragraphs[0].text = "Page "
+    if template.branded:
+        header.add_paragraph(f"SOW for {client_name}")
+        add_page_number_footer(section.footer.add_paragraph())
+    else:
+        header.paragraphs[0].text = f"SOW for {client_name}"
+        add_page_number_footer(section.footer.paragraphs[0])
 
     return doc
+
+def render_docx(proposal_content, client_name, template_path=None):
+    # Build and serialize the document in one pass; returns the .docx bytes
+    with span("docx") as record:
+        doc = generate_docx(proposal_content, client_name, template_path=template_path)
+        docx_bytes = io.BytesIO()
+        doc.save(docx_bytes)
+        record["attributes"]["bytes"] = docx_bytes.tell()
+    logging.info(f"DOCX rendered ({docx_bytes.tell()} bytes)")
+    return docx_bytes.getvalue()
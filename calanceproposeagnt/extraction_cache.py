@@ -0,0 +1,124 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+DEFAULT_MAX_BYTES = int(os.environ.get("EXTRACTION_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+DEFAULT_CACHE_DIR = os.environ.get("EXTRACTION_CACHE_DIR")
+
+class ExtractionCache:
+    """Two-tier cache of extracted document text keyed by content hash.
+
+    The memory tier is an LRU bounded by the UTF-8 size of the stored text.
+    The optional disk tier keeps one file per key under ``cache_dir`` so the
+    same upload is parsed once per deployment rather than once per rerun.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, cache_dir=None):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(file_name, data, version):
+        file_extension = file_name.split('.')[-1].lower()
+        digest = hashlib.sha256(data).hexdigest()
+        return f"{digest}-{file_extension}-v{version}"
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+
+        text = self._read_disk(key)
+        with self._lock:
+            if text is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._store(key, text)
+        return text
+
+    def put(self, key, text):
+        with self._lock:
+            self._store(key, text)
+        self._write_disk(key, text)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "bytes": self._size,
+            }
+
+    def _store(self, key, text):
+        size = len(text.encode('utf-8'))
+        if key in self._entries:
+            self._size -= self._entries.pop(key)[1]
+        if size > self.max_bytes:
+            # Too large for the memory tier; the disk tier still holds it
+            return
+        self._entries[key] = (text, size)
+        self._size += size
+        while self._size > self.max_bytes:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self._size -= evicted_size
+
+    def _path_for(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.txt")
+
+    def _read_disk(self, key):
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._path_for(key), 'r', encoding='utf-8') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logging.warning(f"Could not read extraction cache entry {key}: {str(e)}")
+            return None
+
+    def _write_disk(self, key, text):
+        if not self.cache_dir:
+            return
+        path = self._path_for(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temp file first so concurrent readers never see a partial entry
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(text)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logging.warning(f"Could not write extraction cache entry {key}: {str(e)}")
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+def get_extraction_cache():
+    # Modules survive Streamlit reruns, so this instance is shared by every session in the process
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = ExtractionCache(max_bytes=DEFAULT_MAX_BYTES, cache_dir=DEFAULT_CACHE_DIR)
+        return _default_cache
@@ -1,31 +1,204 @@
 import io
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from docx import Document
 import fitz  # For handling PDF files
 import openpyxl  # For handling .xlsx files
+from tracing import span
+
+# Bump whenever the extraction output changes so cached text is not reused
+EXTRACTOR_VERSION = "2"
+
+# Worker processes used when several uploads (or pages of one large PDF) need parsing
+MAX_WORKERS = int(os.environ.get("EXTRACTION_MAX_WORKERS", os.cpu_count() or 1))
+# PDFs with at least this many pages are split into page ranges across the pool
+PDF_PARALLEL_PAGE_THRESHOLD = int(os.environ.get("EXTRACTION_PDF_PARALLEL_PAGES", 50))
+# Caps on how much of a workbook is turned into text; anything beyond is dropped with a marker
+XLSX_MAX_ROWS = int(os.environ.get("EXTRACTION_XLSX_MAX_ROWS", 20000))
+XLSX_MAX_CELLS = int(os.environ.get("EXTRACTION_XLSX_MAX_CELLS", 200000))
+XLSX_MAX_CHARS = int(os.environ.get("EXTRACTION_XLSX_MAX_CHARS", 2000000))
+
+def read_file_bytes(file):
+    # Streamlit's UploadedFile keeps its read position across reruns, so prefer getvalue()
+    if hasattr(file, 'getvalue'):
+        return file.getvalue()
+    return file.read()
+
+def _file_extension(file_name):
+    return file_name.split('.')[-1].lower()
+
+def iter_pdf_pages(data, start=0, stop=None):
+    pdf_document = fitz.open(stream=data, filetype="pdf")
+    try:
+        stop = len(pdf_document) if stop is None else min(stop, len(pdf_document))
+        for page_num in range(start, stop):
+            yield pdf_document.load_page(page_num).get_text()
+    finally:
+        pdf_document.close()
+
+def _format_row(row):
+    # Drop trailing empty cells so sparse sheets don't turn into runs of blank columns
+    cells = ["" if cell is None else str(cell) for cell in row]
+    while cells and not cells[-1].strip():
+        cells.pop()
+    return "\t".join(cells)
+
+def iter_xlsx_rows(data, max_rows=None, max_cells=None, max_chars=None):
+    max_rows = XLSX_MAX_ROWS if max_rows is None else max_rows
+    max_cells = XLSX_MAX_CELLS if max_cells is None else max_cells
+    max_chars = XLSX_MAX_CHARS if max_chars is None else max_chars
+
+    # read_only streams rows from the sheet XML without building the cell/style object graph
+    workbook = openpyxl.load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+    rows = cells = chars = 0
+    try:
+        for sheet in workbook.worksheets:
+            header = f"Sheet: {sheet.title}\n"
+            chars += len(header)
+            yield header
+            for row in sheet.iter_rows(values_only=True):
+                line = _format_row(row)
+                if not line:
+                    continue
+                row_cells = line.count("\t") + 1
+                if rows + 1 > max_rows:
+                    reason = f"row limit of {max_rows}"
+                elif cells + row_cells > max_cells:
+                    reason = f"cell limit of {max_cells}"
+                elif chars + len(line) + 1 > max_chars:
+                    reason = f"character limit of {max_chars}"
+                else:
+                    rows += 1
+                    cells += row_cells
+                    chars += len(line) + 1
+                    yield line + "\n"
+                    continue
+                logging.warning(f"Workbook truncated in sheet '{sheet.title}' after {rows} rows: {reason} reached")
+                yield f"[Truncated: workbook content after {rows} rows in sheet '{sheet.title}' omitted ({reason} reached)]\n"
+                return
+    finally:
+        workbook.close()
+
+def iter_text_chunks(file_name, data):
+    file_extension = _file_extension(file_name)
 
-def extract_text_from_file(file):
-    file_extension = file.name.split('.')[-1].lower()
-    
     if file_extension == 'txt':
-        return file.read().decode('utf-8')
+        yield data.decode('utf-8')
     elif file_extension == 'docx':
-        doc = Document(io.BytesIO(file.read()))
-        return "\n".join([paragraph.text for paragraph in doc.paragraphs])
+        doc = Document(io.BytesIO(data))
+        for index, paragraph in enumerate(doc.paragraphs):
+            if index:
+                yield "\n"
+            yield paragraph.text
     elif file_extension == 'pdf':
-        pdf_document = fitz.open(stream=file.read(), filetype="pdf")
-        text = ""
-        for page_num in range(len(pdf_document)):
-            page = pdf_document.load_page(page_num)
-            text += page.get_text()
-        return text
+        yield from iter_pdf_pages(data)
     elif file_extension == 'xlsx':
-        workbook = openpyxl.load_workbook(file)
-        text = ""
-        for sheet_name in workbook.sheetnames:
-            sheet = workbook[sheet_name]
-            text += f"Sheet: {sheet_name}\n"
-            for row in sheet.iter_rows(values_only=True):
-                text += "\t".join(str(cell) for cell in row) + "\n"
-        return text
+        yield from iter_xlsx_rows(data)
     else:
-        return "Unsupported file type"
+        yield "Unsupported file type"
+
+def extract_text_from_bytes(file_name, data):
+    return "".join(iter_text_chunks(file_name, data))
+
+def extract_pdf_page_range(data, start, stop):
+    return "".join(iter_pdf_pages(data, start, stop))
+
+def extract_text_from_file(file, cache=None):
+    data = read_file_bytes(file)
+    if cache is None:
+        return extract_text_from_bytes(file.name, data)
+
+    key = cache.make_key(file.name, data, EXTRACTOR_VERSION)
+    text = cache.get(key)
+    if text is None:
+        text = extract_text_from_bytes(file.name, data)
+        cache.put(key, text)
+    return text
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _mp_context():
+    # Forking the server would copy locks held by its other threads (logging, HTTP pools,
+    # background jobs) into the workers, which can deadlock them; start workers from a
+    # clean forkserver process instead (spawn where that isn't available, e.g. Windows)
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return multiprocessing.get_context(method)
+
+def _get_pool():
+    # Reused across Streamlit reruns; starting worker processes is far more expensive than a parse
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=MAX_WORKERS, mp_context=_mp_context())
+        return _pool
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+def _pdf_page_count(data):
+    with fitz.open(stream=data, filetype="pdf") as pdf_document:
+        return len(pdf_document)
+
+def _plan_tasks(file_name, data):
+    # Returns the (function, args) pieces whose outputs concatenate to the file's text
+    if _file_extension(file_name) == 'pdf' and MAX_WORKERS > 1:
+        page_count = _pdf_page_count(data)
+        if page_count >= PDF_PARALLEL_PAGE_THRESHOLD:
+            step = -(-page_count // MAX_WORKERS)
+            return [(extract_pdf_page_range, (data, start, start + step)) for start in range(0, page_count, step)]
+    return [(extract_text_from_bytes, (file_name, data))]
+
+def _run_tasks(tasks):
+    if MAX_WORKERS <= 1 or len(tasks) <= 1:
+        return [func(*args) for func, args in tasks]
+    try:
+        pool = _get_pool()
+        futures = [pool.submit(func, *args) for func, args in tasks]
+        return [future.result() for future in futures]
+    except BrokenProcessPool as e:
+        logging.warning(f"Extraction pool failed, falling back to in-process extraction: {str(e)}")
+        _reset_pool()
+        return [func(*args) for func, args in tasks]
+
+def extract_texts(files, cache=None):
+    """Extract text from several uploads, returning ``(file_name, text)`` pairs in input order.
+
+    Cache hits are served directly; the remaining files (and page ranges of large
+    PDFs) are parsed concurrently in a shared process pool.
+    """
+    with span("extraction", files=len(files)) as record:
+        results = [None] * len(files)
+        pending = []
+        for index, file in enumerate(files):
+            data = read_file_bytes(file)
+            key = cache.make_key(file.name, data, EXTRACTOR_VERSION) if cache is not None else None
+            text = cache.get(key) if cache is not None else None
+            if text is not None:
+                results[index] = (file.name, text)
+            else:
+                pending.append((index, file.name, data, key))
+        record["attributes"]["cache_hits"] = len(files) - len(pending)
+
+        tasks = []
+        task_slices = []
+        for index, file_name, data, key in pending:
+            file_tasks = _plan_tasks(file_name, data)
+            task_slices.append((index, file_name, key, len(tasks), len(tasks) + len(file_tasks)))
+            tasks.extend(file_tasks)
+
+        outputs = _run_tasks(tasks)
+        for index, file_name, key, start, stop in task_slices:
+            text = "".join(outputs[start:stop])
+            if cache is not None:
+                cache.put(key, text)
+            results[index] = (file_name, text)
+        return results
@@ -0,0 +1,79 @@
+import hashlib
+import json
+import os
+import re
+import time
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from research import SearchBackend
+from templates import REQUIRED_KEYS
+
+# Simulated provider latency for offline runs and benchmarks
+FAKE_LLM_LATENCY = float(os.environ.get("FAKE_LLM_LATENCY", 0))
+FAKE_LLM_TOKEN_LATENCY = float(os.environ.get("FAKE_LLM_TOKEN_LATENCY", 0))
+FAKE_SEARCH_LATENCY = float(os.environ.get("FAKE_SEARCH_LATENCY", 0))
+
+def stub_response(prompt):
+    # Deterministic answers shaped like what each prompt in the pipeline asks for
+    if "Final Answer:" in prompt:
+        return "Thought: I now know the final answer\nFinal Answer: Stub research summary."
+    if "search strings" in prompt:
+        return "stub search query"
+    section = re.search(r"Section: (.+)", prompt)
+    if section:
+        return f"Stub content for the {section.group(1).strip()} section."
+    proposal = {key: f"Stub {key.replace('_', ' ')}." for key in REQUIRED_KEYS}
+    proposal["date"] = "2024-01-01"
+    proposal["project_name"] = "Stub Project"
+    return json.dumps(proposal, indent=2)
+
+class FakeChatModel(BaseChatModel):
+    """Offline chat model with canned, deterministic answers and simulated latency.
+
+    ``latency`` is waited before the first token and ``token_latency`` before each
+    further streamed chunk, so benchmarks can model a slow provider without a network.
+    """
+
+    model_name: str = "fake"
+    latency: float = FAKE_LLM_LATENCY
+    token_latency: float = FAKE_LLM_TOKEN_LATENCY
+
+    @property
+    def _llm_type(self):
+        return "fake"
+
+    @property
+    def _identifying_params(self):
+        return {"model_name": self.model_name}
+
+    def _respond(self, messages):
+        return stub_response("\n".join(str(message.content) for message in messages))
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        text = self._respond(messages)
+        time.sleep(self.latency + self.token_latency * max(0, len(re.findall(r"\S+\s*", text)) - 1))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        for index, piece in enumerate(re.findall(r"\s*\S+\s*", self._respond(messages))):
+            if index:
+                time.sleep(self.token_latency)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=piece))
+            if run_manager:
+                run_manager.on_llm_new_token(piece, chunk=chunk)
+            yield chunk
+
+class FakeSearchBackend(SearchBackend):
+    """Search backend returning a deterministic snippet per query after ``latency`` seconds."""
+
+    name = "fake"
+
+    def __init__(self, latency=FAKE_SEARCH_LATENCY):
+        self.latency = latency
+
+    def search(self, query):
+        time.sleep(self.latency)
+        digest = hashlib.sha256(query.encode('utf-8')).hexdigest()[:8]
+        return f"Result {digest} for '{query}': industry practice, typical timelines and delivery risks."
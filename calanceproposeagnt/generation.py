@@ -0,0 +1,234 @@
+import asyncio
+import datetime
+import logging
+from functools import lru_cache
+from langchain.schema.output_parser import StrOutputParser
+from langchain_core.runnables import RunnableLambda
+from config import DEFAULT_MAX_CONCURRENCY, DEFAULT_SECTION_RETRIES
+from context import assemble_context, get_model_name
+from library import section_drafts
+from llm_cache import astream_text, stream_text
+from parsing import parse_proposal
+from research import perform_research
+from retrieval import build_evidence_scorer, get_index
+from streaming import StreamAborted, Throttle, parse_partial_json
+from tracing import get_tracer, span
+from templates import SECTION_DESCRIPTIONS, REQUIRED_KEYS, get_prompt_template, get_response_schemas, get_section_adaptation_template, get_section_prompt_template
+from utils import CustomOutputParser
+
+@lru_cache(maxsize=None)
+def get_output_parser():
+    return CustomOutputParser.from_response_schemas(get_response_schemas())
+
+@lru_cache(maxsize=None)
+def get_format_instructions():
+    return get_output_parser().get_format_instructions()
+
+def ensure_required_keys(proposal, fallback=None):
+    fallback = fallback or {}
+    for key in REQUIRED_KEYS:
+        if key not in proposal:
+            proposal[key] = fallback.get(key, "Not provided")
+    return proposal
+
+def clean_project_name(text):
+    # Models tend to wrap a short answer in quotes or add a trailing period
+    lines = text.strip().splitlines()
+    return (lines[0].strip(' "\'.*') if lines else "") or "Not provided"
+
+def exemplar_source(hit):
+    # Source name of a past section in the prompt, which also tells the model how to use it
+    return (f"past proposal #{hit['proposal_id']}, {hit['section'].replace('_', ' ').title()} section "
+            f"(written for another client; reuse its structure and standard terms, not its client-specific details)")
+
+def prepare_generation_inputs(llm, requirements, documents, additional_info, context_budget, research=perform_research,
+                              library=None, project_type=None):
+    """Retrieve evidence, run research and pack both into the prompt inputs for generation.
+
+    ``research`` is called like ``perform_research``; pass None to skip it. With a
+    ``library`` (a ``ProposalLibrary``), the closest sections of past proposals are added
+    as examples, and ``section_drafts`` lists the sections close enough to adapt. Returns
+    a dict with the ``user_input`` for single-call generation, the per-section
+    ``section_context``, the context assembly report, the retrieved ``section_evidence``
+    and ``exemplars``, and any ``research_warning`` to show the user.
+    """
+    # Only chunks retrieved for some proposal section are eligible for the prompt
+    with span("retrieval", documents=len(documents)):
+        evidence_scorer, section_evidence = build_evidence_scorer(get_index(documents), requirements)
+    research_text = ""
+    research_warning = None
+    if research is not None:
+        document_context = assemble_context(requirements, documents, context_budget, scorer=evidence_scorer, min_score=1.0)
+        research_input = f"{requirements}\n\n{document_context['text']}".strip()
+        try:
+            research_result = research(research_input, additional_info, llm)
+            if research_result["status"] == "success":
+                research_text = research_result['data']
+            else:
+                research_warning = research_result["message"]
+                research_text = research_result['message']
+        except StreamAborted:
+            raise
+        except Exception as e:
+            research_warning = f"An error occurred during research: {str(e)}"
+            research_text = "Research could not be completed due to an error."
+
+    exemplars = {}
+    if library is not None:
+        with span("library") as record:
+            exemplars = library.exemplars(requirements, project_type)
+            record["attributes"]["matches"] = sum(len(hits) for hits in exemplars.values())
+    drafts = section_drafts(exemplars)
+
+    # Pack documents, research and the best past sections into the model's token budget, most relevant chunks first
+    research_sources = [("Research Result", research_text)] if research_text else []
+    exemplar_sources = [(exemplar_source(hits[0]), hits[0]["text"]) for hits in exemplars.values() if hits]
+    with span("context", budget=context_budget) as record:
+        context = assemble_context(
+            requirements,
+            documents + research_sources + exemplar_sources,
+            context_budget,
+            scorer=evidence_scorer,
+            min_score=1.0
+        )
+        record["attributes"]["tokens"] = context["tokens"]
+
+    # Per-section mode gives each section only its own retrieved evidence, the research and its
+    # own past versions (except one that is being adapted, which the prompt already contains)
+    section_context = None
+    if documents or any(exemplars.values()):
+        section_context = {
+            section: "\n\n".join(
+                [requirements]
+                + [f"Content from {hit['source']}:\n{hit['text']}" for hit in hits]
+                + [f"Research Result:\n{text}" for _, text in research_sources]
+                + [f"Content from {exemplar_source(hit)}:\n{hit['text']}"
+                   for hit in exemplars.get(section, [])[1 if section in drafts else 0:]]
+            ).strip()
+            for section, hits in section_evidence.items()
+        }
+
+    return {
+        "user_input": f"{requirements}\n\n{context['text']}".strip(),
+        "section_context": section_context,
+        "context": context,
+        "section_evidence": section_evidence,
+        "exemplars": exemplars,
+        "section_drafts": drafts,
+        "research_warning": research_warning,
+    }
+
+def generate_proposal(llm, client_name, project_type, user_input, additional_info, on_update=None):
+    # Single completion returning every section as one JSON object.
+    # With on_update, the partially parsed object is passed to it while the completion streams.
+    format_instructions = get_format_instructions()
+    prompt = get_prompt_template(client_name, project_type, user_input, additional_info, format_instructions)
+    inputs = {
+        "client_name": client_name,
+        "project_type": project_type,
+        "user_input": user_input,
+        "additional_info": additional_info,
+        "format_instructions": format_instructions
+    }
+    with span("generation", mode="single", streaming=on_update is not None):
+        if on_update is None:
+            text = (prompt | llm | StrOutputParser()).invoke(inputs)
+        else:
+            pieces = []
+            throttle = Throttle()
+            for piece in stream_text(prompt, llm, inputs):
+                pieces.append(piece)
+                if throttle.ready():
+                    on_update(parse_partial_json("".join(pieces)))
+            text = "".join(pieces)
+
+        # Repair what can be repaired and ask again only for sections that are still missing
+        reask_context = f"Client Name: {client_name}\nProject Type: {project_type}\nProject Requirements: {user_input}\nAdditional Information: {additional_info}"
+        result = ensure_required_keys(parse_proposal(text, REQUIRED_KEYS, llm=llm, context=reask_context, on_update=on_update))
+        if on_update is not None:
+            on_update(result)
+        return result
+
+async def astream_section(prompt, llm, section, inputs, semaphore, retries, on_update):
+    # Stream one section's completion under the semaphore, retrying with backoff.
+    # Returns the text, or the last exception once the retries are used up.
+    async with semaphore:
+        for attempt in range(retries + 1):
+            pieces = []
+            throttle = Throttle()
+            try:
+                async for text in astream_text(prompt, llm, inputs):
+                    pieces.append(text)
+                    if throttle.ready():
+                        on_update(section, "".join(pieces))
+                text = "".join(pieces)
+                on_update(section, text)
+                return text
+            except StreamAborted:
+                raise
+            except Exception as e:
+                if attempt == retries:
+                    return e
+                logging.warning(f"Section {section} failed on attempt {attempt + 1}, retrying: {str(e)}")
+                get_tracer().record_retry(get_model_name(llm))
+                await asyncio.sleep(min(2 ** attempt, 10))
+
+async def agenerate_proposal_by_section(llm, client_name, project_type, user_input, additional_info,
+                                        section_context=None, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                                        retries=DEFAULT_SECTION_RETRIES, on_update=None, section_drafts=None):
+    """Generate each section with its own completion, running up to ``max_concurrency`` at once.
+
+    ``section_context`` optionally maps a section name to the requirements/evidence text
+    for that section; other sections use ``user_input``. ``section_drafts`` maps sections
+    to text from a similar past proposal, which is adapted instead of writing the section
+    from scratch. A section that still fails after ``retries`` retries is reported as
+    "Not provided" instead of failing the proposal. With ``on_update``, sections are
+    streamed and ``on_update(section, text_so_far)`` is called as each one is written.
+    """
+    section_context = section_context or {}
+    section_drafts = section_drafts or {}
+    sections = [name for name in REQUIRED_KEYS if name != "date"]
+    writing_prompt = get_section_prompt_template()
+    adaptation_prompt = get_section_adaptation_template()
+
+    def prompt(section_inputs):
+        return adaptation_prompt if "prior_section" in section_inputs else writing_prompt
+
+    chain = RunnableLambda(prompt) | llm | StrOutputParser()
+    inputs = [{
+        "client_name": client_name,
+        "project_type": project_type,
+        "user_input": section_context.get(section, user_input),
+        "additional_info": additional_info,
+        "section_title": section.replace('_', ' ').title(),
+        "section_description": SECTION_DESCRIPTIONS[section],
+        **({"prior_section": section_drafts[section]} if section in section_drafts else {}),
+    } for section in sections]
+
+    with span("generation", mode="sections", streaming=on_update is not None, sections=len(sections), adapted=len(section_drafts)):
+        if on_update is None:
+            outputs = await chain.with_retry(stop_after_attempt=retries + 1).abatch(
+                inputs, config={"max_concurrency": max_concurrency}, return_exceptions=True
+            )
+        else:
+            semaphore = asyncio.Semaphore(max_concurrency)
+            outputs = await asyncio.gather(*[
+                astream_section(prompt(section_inputs), llm, section, section_inputs, semaphore, retries, on_update)
+                for section, section_inputs in zip(sections, inputs)
+            ])
+
+    # The date is not worth a model call
+    result = {"date": datetime.date.today().strftime("%Y-%m-%d")}
+    for section, output in zip(sections, outputs):
+        if isinstance(output, Exception):
+            logging.error(f"Section {section} failed after {retries + 1} attempts: {str(output)}")
+            result[section] = "Not provided"
+        else:
+            result[section] = output.strip() or "Not provided"
+    if "project_name" in result:
+        result["project_name"] = clean_project_name(result["project_name"])
+    return ensure_required_keys(result)
+
+def generate_proposal_by_section(llm, client_name, project_type, user_input, additional_info, **kwargs):
+    # Streamlit runs the script in a thread without an event loop, so asyncio.run is safe here
+    return asyncio.run(agenerate_proposal_by_section(llm, client_name, project_type, user_input, additional_info, **kwargs))
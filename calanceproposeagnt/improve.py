@@ -1,39 +1,98 @@
+import asyncio
 import json
 import logging
-from langchain.prompts import ChatPromptTemplate
+from langchain.schema.output_parser import StrOutputParser
+from config import DEFAULT_MAX_CONCURRENCY, DEFAULT_SECTION_RETRIES
+from generation import astream_section, clean_project_name
+from llm_cache import stream_text
+from parsing import parse_proposal
+from streaming import Throttle, message_text, parse_partial_json
+from templates import REQUIRED_KEYS, SECTION_DESCRIPTIONS, get_improvement_template, get_section_improvement_template
+from tracing import span, traced
 
-def improve_proposal(proposal_content, comments, llm):
-    prompt = ChatPromptTemplate.from_template(
-        """You are an expert proposal reviewer. Improve the following proposal sections based on the comments provided:
+# Characters of the project description given to each section as context
+SECTION_CONTEXT_CHARS = 800
 
-        {proposal_content}
-        Comments: {comments}
-
-        Ensure the improvements are professional and address the comments effectively. Return the improved proposal as a JSON object with the same structure as the original proposal. Make sure to include all required sections: date, project_name, description, purpose, scope, approach, engagement_approach, project_estimated_timeline, development_hosting_support_maintenance_estimates, and risks_constraints_dependencies."""
-    )
+@traced("improvement")
+def improve_proposal(proposal_content, comments, llm, on_update=None):
+    prompt = get_improvement_template()
     chain = prompt | llm
-    improved_proposal = chain.invoke({"proposal_content": json.dumps(proposal_content), "comments": json.dumps(comments)})
-    
-    if isinstance(improved_proposal, str):
-        try:
-            parsed_proposal = json.loads(improved_proposal)
-        except json.JSONDecodeError:
-            logging.error("Failed to parse the improved proposal")
-            parsed_proposal = proposal_content
-    elif hasattr(improved_proposal, 'content'):
-        try:
-            parsed_proposal = json.loads(improved_proposal.content)
-        except json.JSONDecodeError:
-            logging.error("Failed to parse the improved proposal")
-            parsed_proposal = proposal_content
+    inputs = {"proposal_content": json.dumps(proposal_content), "comments": json.dumps(comments)}
+    if on_update is None:
+        improved_proposal = chain.invoke(inputs)
     else:
-        logging.error("Unexpected response format")
-        parsed_proposal = proposal_content
+        # Stream the rewrite, passing the partially parsed object to on_update as it arrives
+        pieces = []
+        throttle = Throttle()
+        for text in stream_text(prompt, llm, inputs):
+            pieces.append(text)
+            if throttle.ready():
+                on_update(parse_partial_json("".join(pieces)))
+        improved_proposal = "".join(pieces)
+
+    # Repair the output and re-ask only for sections that are missing or unusable, giving
+    # the model just those sections' original text and comments
+    def reask_context(problems):
+        return "\n\n".join(
+            f"Original {key}: {proposal_content.get(key, '')}\nComment: {comments.get(key, '')}" for key in problems
+        )
+
+    # Sections without a comment just keep their original content if the model dropped them
+    unchanged = {key: value for key, value in proposal_content.items() if not str(comments.get(key, "")).strip()}
+    text = message_text(improved_proposal)
+    parsed_proposal = parse_proposal(text, REQUIRED_KEYS, llm=llm, context=reask_context, fallback=unchanged, on_update=on_update)
 
-    # Ensure all required keys are present
-    required_keys = ['date', 'project_name', 'description', 'purpose', 'scope', 'approach', 'engagement_approach', 'project_estimated_timeline', 'development_hosting_support_maintenance_estimates', 'risks_constraints_dependencies']
-    for key in required_keys:
+    # Anything still missing keeps its original content
+    for key in REQUIRED_KEYS:
         if key not in parsed_proposal:
             parsed_proposal[key] = proposal_content.get(key, "Not provided")
 
     return parsed_proposal
+
+async def aimprove_sections(proposal_content, comments, llm, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                            retries=DEFAULT_SECTION_RETRIES, on_update=None):
+    """Revise only the sections that have a comment, concurrently, and patch them into a copy of the proposal.
+
+    Each call gets the commented section, its comment and a short project description,
+    so cost and latency grow with the amount of feedback rather than the proposal size.
+    A section that still fails after ``retries`` retries keeps its original content.
+    With ``on_update``, revisions are streamed and ``on_update(section, text_so_far)``
+    is called as each one is written.
+    """
+    sections = [section for section, comment in comments.items() if comment and comment.strip() and section in proposal_content]
+    improved = dict(proposal_content)
+    if not sections:
+        return improved
+
+    with span("improvement", mode="incremental", sections=len(sections)):
+        prompt = get_section_improvement_template()
+        inputs = [{
+            "project_name": proposal_content.get("project_name", ""),
+            "project_description": str(proposal_content.get("description", ""))[:SECTION_CONTEXT_CHARS],
+            "section_title": section.replace('_', ' ').title(),
+            "section_description": SECTION_DESCRIPTIONS.get(section, ""),
+            "section_content": str(proposal_content[section]),
+            "comment": comments[section].strip(),
+        } for section in sections]
+
+        if on_update is None:
+            chain = prompt | llm | StrOutputParser()
+            outputs = await chain.with_retry(stop_after_attempt=retries + 1).abatch(
+                inputs, config={"max_concurrency": max_concurrency}, return_exceptions=True
+            )
+        else:
+            semaphore = asyncio.Semaphore(max_concurrency)
+            outputs = await asyncio.gather(*[
+                astream_section(prompt, llm, section, section_inputs, semaphore, retries, on_update)
+                for section, section_inputs in zip(sections, inputs)
+            ])
+
+        for section, output in zip(sections, outputs):
+            if isinstance(output, Exception):
+                logging.error(f"Improving section {section} failed after {retries + 1} attempts: {str(output)}")
+            elif output.strip():
+                improved[section] = clean_project_name(output) if section == "project_name" else output.strip()
+        return improved
+
+def improve_sections(proposal_content, comments, llm, **kwargs):
+    return asyncio.run(aimprove_sections(proposal_content, comments, llm, **kwargs))
@@ -0,0 +1,206 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from streaming import StreamAborted
+
+# Proposals generated at once per server; the rest wait in the queue
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 4))
+# Finished jobs are kept this long so a reloaded page can pick up the result
+JOB_RETENTION_SECONDS = float(os.environ.get("JOB_RETENTION_SECONDS", 3600))
+# How often the page polls a running job for progress
+JOB_POLL_SECONDS = float(os.environ.get("JOB_POLL_SECONDS", 1.0))
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+class JobCancelled(StreamAborted):
+    pass
+
+class Job:
+    """A unit of work run by the JobRunner, with the progress it has reported so far.
+
+    The work function receives the job and reports through ``update``/``update_section``
+    (partial results by key) and ``add_detail`` (anything else the page should show).
+    Both raise JobCancelled once ``cancel`` has been requested, which is how a running
+    job stops early. Sessions waiting on the job are its ``owners``; one that loses
+    interest calls ``release``, which only cancels the job once no owner is left.
+    """
+
+    def __init__(self, kind, key=None, inputs=None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.key = key
+        self.inputs = inputs
+        self.status = QUEUED
+        self.partial = {}
+        self.details = {}
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.future = None
+        self.owners = set()
+        self._cancel_requested = threading.Event()
+        self._lock = threading.Lock()
+
+    def update(self, values):
+        self._check_cancelled()
+        for key, value in values.items():
+            self.update_section(key, value)
+
+    def update_section(self, key, value):
+        self._check_cancelled()
+        with self._lock:
+            self.partial[key] = value
+
+    def add_detail(self, name, value):
+        self._check_cancelled()
+        with self._lock:
+            self.details[name] = value
+
+    def snapshot(self):
+        # Consistent copy of the progress for rendering from another thread
+        with self._lock:
+            return dict(self.partial), dict(self.details)
+
+    def claim(self, owner):
+        with self._lock:
+            self.owners.add(owner)
+
+    def release(self, owner):
+        # Another session may be waiting on the same job; it keeps running for them
+        with self._lock:
+            self.owners.discard(owner)
+            orphaned = not self.owners
+        if orphaned and not self.done:
+            self.cancel()
+
+    def cancel(self):
+        self._cancel_requested.set()
+        if self.future is not None and self.future.cancel():
+            self._finish(CANCELLED)
+
+    @property
+    def cancel_requested(self):
+        return self._cancel_requested.is_set()
+
+    @property
+    def done(self):
+        return self.status in FINISHED
+
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+    def _check_cancelled(self):
+        if self.cancel_requested:
+            raise JobCancelled(f"Job {self.id} was cancelled")
+
+    def _finish(self, status, result=None, error=None):
+        with self._lock:
+            self.status = status
+            self.result = result
+            self.error = error
+            self.finished = time.time()
+
+class JobRunner:
+    """Thread pool running jobs off the Streamlit script thread, with a table of jobs by ID.
+
+    One runner is shared by every session (see ``get_job_runner``), so reruns, reloads
+    and other users see the same jobs. Jobs submitted with a ``key`` (a fingerprint of
+    their inputs) are deduplicated: while a job with that key is queued, running or
+    retained as done, submitting again returns it instead of starting another. The
+    submitting ``owner`` (e.g. a session ID) is added to the job's owners either way.
+    """
+
+    def __init__(self, max_workers=JOB_WORKERS, retention_seconds=JOB_RETENTION_SECONDS):
+        self.retention_seconds = retention_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="proposal-job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, kind, func, key=None, inputs=None, refresh=False, owner=None):
+        """Queue ``func(job)`` and return its Job; ``refresh`` replaces a finished job with the same key."""
+        with self._lock:
+            self._prune()
+            job = self._find(key) if key else None
+            if job is None or (refresh and job.done) or job.status in (FAILED, CANCELLED) or job.cancel_requested:
+                job = Job(kind, key=key, inputs=inputs)
+                self._jobs[job.id] = job
+                job.future = self._executor.submit(self._run, job, func)
+            if owner is not None:
+                job.claim(owner)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job is not None and not job.done:
+            job.cancel()
+
+    def jobs(self):
+        with self._lock:
+            return sorted(self._jobs.values(), key=lambda job: job.created)
+
+    def counts(self):
+        counts = {}
+        for job in self.jobs():
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return counts
+
+    def shutdown(self, wait=True):
+        for job in self.jobs():
+            job.cancel()
+        self._executor.shutdown(wait=wait)
+
+    def _run(self, job, func):
+        if job.cancel_requested:
+            job._finish(CANCELLED)
+            return
+        job.started = time.time()
+        job.status = RUNNING
+        logging.info(f"Job {job.id} ({job.kind}) started")
+        try:
+            result = func(job)
+        except JobCancelled:
+            logging.info(f"Job {job.id} ({job.kind}) cancelled")
+            job._finish(CANCELLED)
+        except Exception as e:
+            logging.exception(f"Job {job.id} ({job.kind}) failed")
+            job._finish(FAILED, error=str(e))
+        else:
+            logging.info(f"Job {job.id} ({job.kind}) finished in {job.elapsed:.1f} s")
+            job._finish(DONE, result=result)
+
+    def _find(self, key):
+        matches = [job for job in self._jobs.values() if job.key == key]
+        return max(matches, key=lambda job: job.created) if matches else None
+
+    def _prune(self):
+        cutoff = time.time() - self.retention_seconds
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.done and job.finished < cutoff]:
+            del self._jobs[job_id]
+
+_runner = None
+_runner_lock = threading.Lock()
+
+def get_job_runner():
+    # Modules survive Streamlit reruns, so every session in the process shares this runner
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            _runner = JobRunner()
+        return _runner
@@ -0,0 +1,199 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+import numpy as np
+from context import tokenize
+from templates import REQUIRED_KEYS
+
+DEFAULT_LIBRARY_PATH = os.environ.get(
+    "PROPOSAL_LIBRARY_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "calance-proposal", "proposal_library.sqlite")
+)
+# Prior sections scoring below this are not worth showing the model
+MIN_SIMILARITY = float(os.environ.get("LIBRARY_MIN_SIMILARITY", 0.15))
+# From this score on, the prior section is adapted instead of writing the section from scratch
+DRAFT_SIMILARITY = float(os.environ.get("LIBRARY_DRAFT_SIMILARITY", 0.6))
+EXEMPLARS_PER_SECTION = int(os.environ.get("LIBRARY_EXEMPLARS_PER_SECTION", 2))
+NUM_PERM = 64
+# Weight of requirement-to-requirement similarity against requirement-to-section similarity
+REQUIREMENTS_WEIGHT = 0.7
+# The date and project name are specific to each proposal and never reused
+LIBRARY_SECTIONS = [key for key in REQUIRED_KEYS if key not in ("date", "project_name")]
+EMPTY_VALUES = {"", "not provided"}
+
+# Multiply-shift hash functions, one per permutation. The seed is fixed, so signatures
+# stored by one process compare with those computed by the next.
+_rng = np.random.default_rng(20240601)
+_A = _rng.integers(0, 2 ** 64, NUM_PERM, dtype=np.uint64, endpoint=False) | np.uint64(1)
+_B = _rng.integers(0, 2 ** 64, NUM_PERM, dtype=np.uint64, endpoint=False)
+
+def shingles(text):
+    tokens = tokenize(text)
+    return set(tokens) | {f"{a}_{b}" for a, b in zip(tokens, tokens[1:])}
+
+def minhash(text):
+    """64-value MinHash signature of the text's word and word-pair set (256 bytes)."""
+    features = np.array([zlib.crc32(shingle.encode('utf-8')) for shingle in shingles(text)], dtype=np.uint64)
+    if not features.size:
+        return np.zeros(NUM_PERM, dtype=np.uint32)
+    # uint64 arithmetic wraps around, which is the mod 2**64 the hash needs
+    hashed = (features[:, None] * _A + _B) >> np.uint64(32)
+    return hashed.min(axis=0).astype(np.uint32)
+
+def similarity(signature, signatures):
+    # Estimated Jaccard similarity of one signature against each row; empty text matches nothing
+    if not signature.any() or not len(signatures):
+        return np.zeros(len(signatures), dtype=np.float32)
+    return (signatures == signature).mean(axis=1, dtype=np.float32) * signatures.any(axis=1)
+
+class ProposalLibrary:
+    """SQLite store of final proposals with a MinHash signature per section.
+
+    Sections are found again by how similar the requirements they were written for are
+    to the new requirements (most of the score) and by how similar the section text
+    itself is to them. Signatures are loaded into one NumPy array per section and
+    compared in a single pass, which is fast enough for thousands of proposals.
+    """
+
+    def __init__(self, path=DEFAULT_LIBRARY_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._arrays = None
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS proposals ("
+            "id INTEGER PRIMARY KEY, key TEXT UNIQUE, client_name TEXT, project_type TEXT, "
+            "requirements TEXT, requirements_signature BLOB, created_at REAL, proposal TEXT)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sections ("
+            "proposal_id INTEGER, section TEXT, text TEXT, signature BLOB, PRIMARY KEY (proposal_id, section))"
+        )
+
+    def add(self, proposal, client_name, project_type, requirements, source_key=None):
+        """Store a final proposal; returns its ID, or None if it is already stored.
+
+        Proposals are identified by ``source_key`` when given (e.g. the draft they were
+        improved from, so each round of comments replaces the previous version) and by
+        their content otherwise.
+        """
+        payload = json.dumps(proposal, sort_keys=True)
+        key = source_key or hashlib.sha256(payload.encode('utf-8')).hexdigest()
+        sections = [
+            (section, str(proposal[section]).strip()) for section in LIBRARY_SECTIONS
+            if str(proposal.get(section, "")).strip().lower() not in EMPTY_VALUES
+        ]
+        signatures = [minhash(text).tobytes() for _, text in sections]
+        with self._lock:
+            existing = self._conn.execute("SELECT id, proposal FROM proposals WHERE key = ?", (key,)).fetchone()
+            if existing is not None and existing[1] == payload:
+                return None
+            self._conn.execute("BEGIN")
+            try:
+                if existing is not None:
+                    self._conn.execute("DELETE FROM sections WHERE proposal_id = ?", (existing[0],))
+                    self._conn.execute("DELETE FROM proposals WHERE id = ?", (existing[0],))
+                cursor = self._conn.execute(
+                    "INSERT INTO proposals (key, client_name, project_type, requirements, requirements_signature, created_at, proposal) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (key, client_name, project_type, requirements, minhash(requirements).tobytes(), time.time(), payload)
+                )
+                proposal_id = cursor.lastrowid
+                self._conn.executemany(
+                    "INSERT INTO sections (proposal_id, section, text, signature) VALUES (?, ?, ?, ?)",
+                    [(proposal_id, section, text, signature) for (section, text), signature in zip(sections, signatures)]
+                )
+            except sqlite3.Error:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            self._arrays = None
+        logging.info(f"Stored proposal {proposal_id} for {client_name} in the library ({len(sections)} sections)")
+        return proposal_id
+
+    def _load(self):
+        # Signatures and metadata per section, rebuilt after each add
+        with self._lock:
+            if self._arrays is not None:
+                return self._arrays
+            rows = self._conn.execute(
+                "SELECT s.section, s.proposal_id, s.signature, p.requirements_signature, p.project_type, p.client_name "
+                "FROM sections s JOIN proposals p ON p.id = s.proposal_id ORDER BY s.proposal_id"
+            ).fetchall()
+            arrays = {}
+            for section, proposal_id, signature, requirements_signature, project_type, client_name in rows:
+                entry = arrays.setdefault(section, {"ids": [], "signatures": [], "requirements": [], "project_types": [], "clients": []})
+                entry["ids"].append(proposal_id)
+                entry["signatures"].append(np.frombuffer(signature, dtype=np.uint32))
+                entry["requirements"].append(np.frombuffer(requirements_signature, dtype=np.uint32))
+                entry["project_types"].append(project_type)
+                entry["clients"].append(client_name)
+            for entry in arrays.values():
+                entry["signatures"] = np.stack(entry["signatures"])
+                entry["requirements"] = np.stack(entry["requirements"])
+                entry["project_types"] = np.array(entry["project_types"], dtype=object)
+            self._arrays = arrays
+            return arrays
+
+    def search(self, section, requirements, project_type=None, k=EXEMPLARS_PER_SECTION, min_score=MIN_SIMILARITY):
+        """The ``k`` stored versions of ``section`` best matching the requirements.
+
+        Proposals of the same project type are preferred; others are only considered
+        when the library has none of that type.
+        """
+        entry = self._load().get(section)
+        if entry is None:
+            return []
+        query = minhash(requirements)
+        scores = (REQUIREMENTS_WEIGHT * similarity(query, entry["requirements"])
+                  + (1 - REQUIREMENTS_WEIGHT) * similarity(query, entry["signatures"]))
+        if project_type and (entry["project_types"] == project_type).any():
+            scores = np.where(entry["project_types"] == project_type, scores, 0.0)
+        top = [i for i in np.argsort(-scores)[:k] if scores[i] >= min_score]
+        if not top:
+            return []
+        with self._lock:
+            texts = dict(self._conn.execute(
+                f"SELECT proposal_id, text FROM sections WHERE section = ? AND proposal_id IN ({','.join('?' * len(top))})",
+                [section] + [entry["ids"][i] for i in top]
+            ).fetchall())
+        return [{
+            "proposal_id": entry["ids"][i],
+            "client_name": entry["clients"][i],
+            "project_type": entry["project_types"][i],
+            "section": section,
+            "text": texts[entry["ids"][i]],
+            "score": float(scores[i]),
+        } for i in top]
+
+    def exemplars(self, requirements, project_type=None, k=EXEMPLARS_PER_SECTION):
+        # Best prior versions of every reusable section
+        return {section: self.search(section, requirements, project_type, k) for section in LIBRARY_SECTIONS}
+
+    def stats(self):
+        with self._lock:
+            proposals = self._conn.execute("SELECT COUNT(*) FROM proposals").fetchone()[0]
+            sections = self._conn.execute("SELECT COUNT(*) FROM sections").fetchone()[0]
+        return {"proposals": proposals, "sections": sections}
+
+_library = None
+_library_lock = threading.Lock()
+
+def get_proposal_library():
+    global _library
+    with _library_lock:
+        if _library is None:
+            _library = ProposalLibrary()
+        return _library
+
+def section_drafts(exemplars, threshold=DRAFT_SIMILARITY):
+    # Sections whose best prior version is close enough to adapt rather than write anew
+    return {section: hits[0]["text"] for section, hits in exemplars.items() if hits and hits[0]["score"] >= threshold}
@@ -0,0 +1,151 @@
+import json
+import logging
+import warnings
+from langchain_core._api import LangChainBetaWarning
+from langchain_core.caches import BaseCache
+from langchain_core.globals import get_llm_cache
+from langchain_core.language_models import BaseChatModel, BaseLanguageModel
+from langchain_core.load import dumps, loads
+from langchain_core.outputs import ChatGeneration, Generation
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableWithFallbacks
+from context import get_model_name
+from response_store import ResponseStore, get_response_store
+from streaming import message_text
+
+class LLMResponseCache(BaseCache):
+    """LangChain cache over a ResponseStore, namespaced by provider.
+
+    LangChain's ``llm_string`` already carries the model name, temperature and other
+    call parameters; the namespace adds the provider so identical model names served
+    by different APIs don't share entries. With ``refresh=True`` lookups always miss
+    but fresh responses are still stored, which is how a user forces regeneration.
+    """
+
+    def __init__(self, store, namespace, refresh=False):
+        self.store = store
+        self.namespace = namespace
+        self.refresh = refresh
+
+    def lookup(self, prompt, llm_string):
+        if self.refresh:
+            return None
+        value = self.store.get(ResponseStore.make_key(self.namespace, llm_string, prompt))
+        if value is None:
+            return None
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", LangChainBetaWarning)
+                return [loads(item) for item in json.loads(value)]
+        except Exception as e:
+            logging.warning(f"Discarding unreadable LLM cache entry: {str(e)}")
+            return None
+
+    def update(self, prompt, llm_string, return_val):
+        value = json.dumps([dumps(generation) for generation in return_val])
+        self.store.put(ResponseStore.make_key(self.namespace, llm_string, prompt), self.namespace, value)
+
+    def clear(self, **kwargs):
+        self.store.clear(self.namespace)
+
+def get_response_cache(provider, refresh=False):
+    return LLMResponseCache(get_response_store(), provider, refresh=refresh)
+
+def _resolve_cache(llm):
+    if not isinstance(llm, BaseLanguageModel):
+        return None
+    if isinstance(llm.cache, BaseCache):
+        return llm.cache
+    if llm.cache is None:
+        return get_llm_cache()
+    return None
+
+def _cache_key(prompt_value, llm):
+    # Mirrors how LangChain keys its own cache so streamed and invoked calls share entries
+    if isinstance(llm, BaseChatModel):
+        return dumps(prompt_value.to_messages()), llm._get_llm_string()
+    params = llm.dict()
+    params["stop"] = None
+    return prompt_value.to_string(), str(sorted(params.items()))
+
+def _generation_for(llm, text):
+    if isinstance(llm, BaseChatModel):
+        return ChatGeneration(message=AIMessage(content=text))
+    return Generation(text=text)
+
+def _fallback_chain(llm):
+    # The models to try in order, and the errors that move on to the next one
+    if isinstance(llm, RunnableWithFallbacks):
+        return [llm.runnable, *llm.fallbacks], llm.exceptions_to_handle
+    return [llm], ()
+
+def _stream_model(prompt_value, llm):
+    cache = _resolve_cache(llm)
+    if cache is not None:
+        cache_prompt, llm_string = _cache_key(prompt_value, llm)
+        cached = cache.lookup(cache_prompt, llm_string)
+        if cached:
+            yield cached[0].text
+            return
+
+    pieces = []
+    for chunk in llm.stream(prompt_value):
+        text = message_text(chunk)
+        pieces.append(text)
+        yield text
+    if cache is not None:
+        cache.update(cache_prompt, llm_string, [_generation_for(llm, "".join(pieces))])
+
+async def _astream_model(prompt_value, llm):
+    cache = _resolve_cache(llm)
+    if cache is not None:
+        cache_prompt, llm_string = _cache_key(prompt_value, llm)
+        cached = await cache.alookup(cache_prompt, llm_string)
+        if cached:
+            yield cached[0].text
+            return
+
+    pieces = []
+    async for chunk in llm.astream(prompt_value):
+        text = message_text(chunk)
+        pieces.append(text)
+        yield text
+    if cache is not None:
+        await cache.aupdate(cache_prompt, llm_string, [_generation_for(llm, "".join(pieces))])
+
+def stream_text(prompt, llm, inputs):
+    """Stream the text of ``prompt | llm``, answering from the LLM's response cache when possible.
+
+    LangChain only consults the cache on invoke/generate, so streaming would otherwise
+    always reach the provider. A model with fallbacks is streamed one model at a time,
+    each with its own cache; like LangChain, the next model is only tried if the
+    previous one failed before producing any output.
+    """
+    prompt_value = prompt.invoke(inputs)
+    models, handled = _fallback_chain(llm)
+    for index, model in enumerate(models):
+        started = False
+        try:
+            for text in _stream_model(prompt_value, model):
+                started = True
+                yield text
+            return
+        except handled as e:
+            if started or index == len(models) - 1:
+                raise
+            logging.warning(f"Falling back from {get_model_name(model)}: {str(e)}")
+
+async def astream_text(prompt, llm, inputs):
+    prompt_value = await prompt.ainvoke(inputs)
+    models, handled = _fallback_chain(llm)
+    for index, model in enumerate(models):
+        started = False
+        try:
+            async for text in _astream_model(prompt_value, model):
+                started = True
+                yield text
+            return
+        except handled as e:
+            if started or index == len(models) - 1:
+                raise
+            logging.warning(f"Falling back from {get_model_name(model)}: {str(e)}")
@@ -1,32 +1,120 @@
 import streamlit as st
-from config import configure_llm
-from extractors import extract_text_from_file
-from research import perform_research
+from config import DEFAULT_MAX_CONCURRENCY, MODEL_CHOICES, configure_providers, get_context_budget, get_llm
+from extraction_cache import get_extraction_cache
+from response_store import get_response_store
 from review import review_and_comment
-from improve import improve_proposal
-from docx_generator import generate_docx
-from templates import get_prompt_template
-from utils import CustomOutputParser
-from langchain.output_parsers import ResponseSchema  # Add this import
-from langchain.schema.runnable import RunnablePassthrough  # Add this import
-from collections import defaultdict  # Add this import
-import io
+from templates import REQUIRED_KEYS
+from views import display_draft_details, display_job_progress, display_proposal, display_trace_panel
+from jobs import CANCELLED, DONE, get_job_runner
+from library import get_proposal_library
+from pipeline import fail_stage, fingerprint, get_stage, get_stage_error, get_stage_key, invalidate, is_current, run_stage
+from tracing import get_tracer
+import hashlib
 import logging
-import json
+import sqlite3
 import uuid
 
+CANCELLED_MESSAGE = "Cancelled."
+
+def document_fingerprints(documents):
+    return [(name, hashlib.sha256(text.encode('utf-8')).hexdigest()) for name, text in documents]
+
+def render_proposal(final_proposal, client_name):
+    from docx_generator import render_docx
+    return render_docx(final_proposal, client_name)
+
+def session_owner():
+    # Jobs are shared by every session; this identifies the ones this session waits on
+    return st.session_state.setdefault('session_id', uuid.uuid4().hex)
+
+def track_job(stage, job):
+    # The draft job's ID also goes in the URL, so a reloaded page finds it again
+    st.session_state.setdefault('jobs', {})[stage] = job.id
+    if stage == "draft":
+        st.query_params["job"] = job.id
+
+def forget_job(stage):
+    st.session_state.setdefault('jobs', {}).pop(stage, None)
+    if stage == "draft":
+        st.query_params.pop("job", None)
+
+def tracked_job(runner, stage):
+    job_id = st.session_state.setdefault('jobs', {}).get(stage)
+    if job_id is None and stage == "draft":
+        job_id = st.query_params.get("job")
+    job = runner.get(job_id) if job_id else None
+    if job is not None:
+        # e.g. a reloaded page picking the draft job up from the URL
+        job.claim(session_owner())
+    return job
+
+def cancel_job(stage, job):
+    # The job only stops if no other session is waiting on it
+    job.release(session_owner())
+    if stage == "improved":
+        fail_stage(st.session_state.pipeline, stage, job.inputs, CANCELLED_MESSAGE)
+    forget_job(stage)
+
+def report_failed_job(stage, job):
+    if job.status == CANCELLED:
+        st.info(CANCELLED_MESSAGE)
+    else:
+        st.error(f"An error occurred: {job.error}")
+    forget_job(stage)
+
 def main():
     st.set_page_config(page_title="AI-Powered Proposal Generator", layout="wide")
     st.title('AI-Powered Proposal Generator')
 
     # Sidebar for API and Model Configuration
     st.sidebar.title('API and Model Configuration')
-    api = st.sidebar.selectbox('Choose an API', ['Ollama', 'OpenRouter', 'OpenAI'])
+    api = st.sidebar.selectbox('Choose an API', list(MODEL_CHOICES))
     api_key = st.sidebar.text_input('Enter API Key (not needed for Ollama)', type='password')
     temp = st.sidebar.slider("Model Temperature", min_value=0.0, max_value=1.0, value=0.7, step=0.1)
 
     # LLM Configuration
-    llm = configure_llm(api, api_key, temp)
+    bypass_cache = st.sidebar.checkbox(
+        'Bypass response cache',
+        value=False,
+        help='Always call the model and overwrite cached responses, e.g. to get a fresh draft.'
+    )
+    providers = configure_providers(api, api_key)
+    model_name = providers[0][1] if providers else None
+    cache_stats = get_response_store().stats()
+    st.sidebar.caption(
+        f"Response cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+        f"{cache_stats['entries']} entries ({cache_stats['bytes'] / (1024 * 1024):.1f} MB)"
+    )
+    context_budget = st.sidebar.number_input(
+        'Context token budget',
+        min_value=500,
+        max_value=200000,
+        value=get_context_budget(model_name),
+        step=500,
+        help='Maximum tokens of document and research content sent with the generation prompt.'
+    )
+    section_mode = st.sidebar.checkbox(
+        'Generate sections concurrently',
+        value=False,
+        help='Write each proposal section with its own model call instead of one large JSON completion.'
+    )
+    incremental_improve = st.sidebar.checkbox(
+        'Improve only commented sections',
+        value=True,
+        help='Rewrite just the sections you commented on, concurrently, instead of regenerating the whole proposal.'
+    )
+    max_concurrency = st.sidebar.number_input('Concurrent section calls', min_value=1, max_value=16, value=DEFAULT_MAX_CONCURRENCY, disabled=not (section_mode or incremental_improve))
+    reuse_library = st.sidebar.checkbox(
+        'Reuse past proposals',
+        value=True,
+        help='Show the model the closest sections of past final proposals as examples; with concurrent sections, '
+             'sections of a near-identical past proposal are adapted instead of written from scratch.'
+    )
+    library_stats = get_proposal_library().stats()
+    st.sidebar.caption(f"Proposal library: {library_stats['proposals']} proposals, {library_stats['sections']} sections")
+    runner = get_job_runner()
+    job_counts = runner.counts()
+    st.sidebar.caption(f"Background jobs: {job_counts.get('running', 0)} running, {job_counts.get('queued', 0)} queued")
 
     # User Input
     client_name = st.text_input('Enter client name:')
@@ -45,212 +133,140 @@ def main():
     additional_info = st.text_area('Enter any additional information or feedback:')
 
     # Process uploaded documents
+    documents = []
     if uploaded_docs:
-        for doc in uploaded_docs:
-            doc_text = extract_text_from_file(doc)
-            user_input += f"\n\nContent from {doc.name}:\n{doc_text}"
-
-    if st.button('Generate Proposal'):
-        if user_input and client_name and llm:
-            with st.spinner('Generating proposal... This may take a few minutes.'):
-                try:
-                    research_result = perform_research(user_input, additional_info, llm)
-                    if research_result["status"] == "success":
-                        user_input += f"\n\nResearch Result:\n{research_result['data']}"
-                    else:
-                        st.warning(research_result["message"])
-                        user_input += f"\n\nResearch Result:\n{research_result['message']}"
-                except Exception as e:
-                    st.warning(f"An error occurred during research: {str(e)}")
-                    research_result = "Research could not be completed due to an error."
-                    user_input += f"\n\nResearch Result:\n{research_result}"
-
-                # Define the output structure based on project type
-                response_schemas = [
-                    ResponseSchema(name="date", description="The date of the proposal"),
-                    ResponseSchema(name="project_name", description="The name of the project"),
-                    ResponseSchema(name="description", description="Brief description of the project and agreement"),
-                    ResponseSchema(name="purpose", description="The purpose of the project"),
-                    ResponseSchema(name="scope", description="Detailed scope of the project, including functional and non-functional requirements"),
-                    ResponseSchema(name="approach", description="The approach to be used for the project, including technological framework and delivery framework"),
-                    ResponseSchema(name="engagement_approach", description="Details on the engagement approach, such as Time & Materials"),
-                    ResponseSchema(name="project_estimated_timeline", description="Estimated timeline for the project"),
-                    ResponseSchema(name="development_hosting_support_maintenance_estimates", description="Estimates for development, hosting, support, and maintenance"),
-                    ResponseSchema(name="risks_constraints_dependencies", description="Identified risks, constraints, and dependencies for the project")
-                ]
-
-                output_parser = CustomOutputParser.from_response_schemas(response_schemas)
-
-                # Create the prompt template
-                prompt = get_prompt_template(client_name, project_type, user_input, additional_info, output_parser.get_format_instructions())
-
-                # Create the chain
-                chain = (
-                    {"client_name": RunnablePassthrough(), 
-                     "project_type": RunnablePassthrough(),
-                     "user_input": RunnablePassthrough(),
-                     "additional_info": RunnablePassthrough(),
-                     "format_instructions": lambda _: output_parser.get_format_instructions()}
-                    | prompt
-                    | llm
-                    | output_parser
-                )
-
-                try:
-                    # Generate the proposal
-                    result = chain.invoke({
-                        "client_name": client_name,
-                        "project_type": project_type,
-                        "user_input": user_input,
-                        "additional_info": additional_info
-                    })
-
-                    # Ensure all required keys are present in the result
-                    required_keys = ['date', 'project_name', 'description', 'purpose', 'scope', 'approach', 'engagement_approach', 'project_estimated_timeline', 'development_hosting_support_maintenance_estimates', 'risks_constraints_dependencies']
-                    for key in required_keys:
-                        if key not in result:
-                            result[key] = "Not provided"
-
-                    # Store the result in session state
-                    st.session_state.result = result
-
-                    # Display the generated proposal
-                    st.subheader("Generated Proposal:")
-                    for section, content in result.items():
-                        st.write(f"**{section.replace('_', ' ').title()}**")
-                        st.write(content)
-                        st.write("---")
-
-                    # Review and comment on the draft proposal
-                    comments = review_and_comment(result)
-
-                    # Store the comments in session state
-                    st.session_state.comments = comments
-
-                    # Improve the proposal based on comments
-                    final_proposal = improve_proposal(result, comments, llm)
-                    
-                    # Ensure all required keys are present in the final proposal
-                    for key in required_keys:
-                        if key not in final_proposal:
-                            final_proposal[key] = "Not provided"
-
-                    # Store the final proposal in session state
-                    st.session_state.final_proposal = final_proposal
-                    logging.info(f"Final proposal structure: {json.dumps(final_proposal, indent=2)}")
-
-                    # Display the final proposal
-                    st.subheader("Final Proposal:")
-                    for section, content in final_proposal.items():
-                        st.write(f"**{section.replace('_', ' ').title()}**")
-                        st.write(content)
-                        st.write("---")
-
-                    # Generate DOCX
-                    logging.info("Generating DOCX file...")
-                    doc = generate_docx(final_proposal, client_name)
-                    logging.info("DOCX file generated successfully")
-
-                    # Save DOCX to BytesIO object
-                    docx_bytes = io.BytesIO()
-                    doc.save(docx_bytes)
-                    docx_bytes.seek(0)
-
-                    # Read the page count from the saved document
-                    doc = Document(docx_bytes)
-                    page_count = len(doc.element.xpath('//w:p'))  # Approximate page count based on paragraphs
-
-                    # Update the footer with the page count
-                    section = doc.sections[0]
-                    footer = section.footer
-                    footer.paragraphs[0].text = f"Page 1 of {page_count}"
-
-                    # Save the updated document to a new BytesIO object
-                    updated_docx_bytes = io.BytesIO()
-                    doc.save(updated_docx_bytes)
-                    updated_docx_bytes.seek(0)
+        from extractors import extract_texts
+        extraction_cache = get_extraction_cache()
+        documents = extract_texts(uploaded_docs, cache=extraction_cache)
+        cache_stats = extraction_cache.stats()
+        logging.info(f"Extraction cache stats: {cache_stats}")
+        st.sidebar.caption(
+            f"Extraction cache: {cache_stats['hits'] + cache_stats['disk_hits']} hits, "
+            f"{cache_stats['misses']} misses, {cache_stats['entries']} entries "
+            f"({cache_stats['bytes'] / (1024 * 1024):.1f} MB)"
+        )
 
-                    # Provide download button with a unique key
-                    st.download_button(
-                        label="Download Proposal as DOCX",
-                        data=updated_docx_bytes,
-                        file_name=f"Proposal_{client_name}.docx",
-                        mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-                        key="unique_download_button_key"  # Add a unique key here
-                    )
+    # Each stage is recomputed only when its inputs change: draft -> reviewed -> improved -> rendered
+    pipeline = st.session_state.setdefault('pipeline', {})
+    model_config = {"api": api, "model": model_name, "temperature": temp}
 
-                    st.success("Proposal generated successfully!")
-                except Exception as e:
-                    st.error(f"An error occurred: {str(e)}")
-        elif not llm:
+    if st.button('Generate Proposal'):
+        if (user_input or documents) and client_name and providers:
+            draft_inputs = {
+                "client_name": client_name,
+                "project_type": project_type,
+                "requirements": user_input,
+                "documents": document_fingerprints(documents),
+                "additional_info": additional_info,
+                "model": model_config,
+                "context_budget": context_budget,
+                "section_mode": section_mode,
+                "library": reuse_library,
+            }
+            if bypass_cache:
+                invalidate(pipeline, "draft")
+            # Generation runs in the background; identical inputs reuse the running or finished job.
+            # Imported here, in the script thread: workers don't see the app directory on sys.path
+            from stages import draft_proposal
+            llm = get_llm(providers, temp, refresh=bypass_cache)
+            job = runner.submit("draft", lambda job: draft_proposal(
+                job, llm, client_name, project_type, user_input, documents, additional_info,
+                context_budget, section_mode, max_concurrency, reuse_library
+            ), key=fingerprint(draft_inputs), inputs=draft_inputs, refresh=bypass_cache, owner=session_owner())
+            track_job("draft", job)
+        elif not providers:
             st.error("Please configure and apply an LLM before generating the proposal.")
-    else:
-        st.warning('Please enter the client name and project requirements.')
-
-    # Check if there are stored results in session state
-    if hasattr(st.session_state, 'result'):
-        st.subheader("Generated Proposal:")
-        for section, content in st.session_state.result.items():
-            st.write(f"**{section.replace('_', ' ').title()}**")
-            st.write(content)
-            st.write("---")
-
-        # Review and comment on the draft proposal
-        comments = review_and_comment(st.session_state.result)
-
-        # Store the comments in session state
-        st.session_state.comments = comments
-
-        # Improve the proposal based on comments
-        final_proposal = improve_proposal(st.session_state.result, st.session_state.comments, llm)
-
-        # Ensure all required keys are present in the final proposal
-        for key in required_keys:
-            if key not in final_proposal:
-                final_proposal[key] = "Not provided"
-
-        # Store the final proposal in session state
-        st.session_state.final_proposal = final_proposal
-
-        # Display the final proposal
-        st.subheader("Final Proposal:")
-        for section, content in final_proposal.items():
-            st.write(f"**{section.replace('_', ' ').title()}**")
-            st.write(content)
-            st.write("---")
-
-        # Generate DOCX
-        doc = generate_docx(final_proposal, client_name)
-        
-        # Save DOCX to BytesIO object
-        docx_bytes = io.BytesIO()
-        doc.save(docx_bytes)
-        docx_bytes.seek(0)
-
-        # Read the page count from the saved document
-        doc = Document(docx_bytes)
-        page_count = len(doc.element.xpath('//w:p'))  # Approximate page count based on paragraphs
-
-        # Update the footer with the page count
-        section = doc.sections[0]
-        footer = section.footer
-        footer.paragraphs[0].text = f"Page 1 of {page_count}"
-
-        # Save the updated document to a new BytesIO object
-        updated_docx_bytes = io.BytesIO()
-        doc.save(updated_docx_bytes)
-        updated_docx_bytes.seek(0)
-
-        # Provide download button with a unique key
-        st.download_button(
-            label="Download Proposal as DOCX",
-            data=updated_docx_bytes,
-            file_name=f"Proposal_{client_name}.docx",
-            mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-            key="unique_download_button_key_2"  # Add a unique key here
-        )
-
-        st.success("Proposal generated successfully!")
+        else:
+            st.warning('Please enter the client name and project requirements.')
+
+    draft_job = tracked_job(runner, "draft")
+    if draft_job is not None:
+        if not draft_job.done:
+            display_job_progress(draft_job, "Generated Proposal:", REQUIRED_KEYS, on_cancel=lambda: cancel_job("draft", draft_job))
+            return
+        if draft_job.status == DONE:
+            # Keyed on the job as well: a regeneration with the same inputs (bypassing the cache) is a
+            # new draft, so it gets empty comments and its own improvement
+            run_stage(pipeline, "draft", {**draft_job.inputs, "job": draft_job.id}, lambda: draft_job.result)
+            display_draft_details(draft_job.details)
+        else:
+            report_failed_job("draft", draft_job)
+
+    draft = get_stage(pipeline, "draft")
+    if draft is None:
+        return
+
+    # Review and comment on the draft proposal; a new draft starts with empty comments
+    comments = review_and_comment(draft, key_prefix=f"comment_{get_stage_key(pipeline, 'draft')[:12]}")
+    reviewed_inputs = {"draft": get_stage_key(pipeline, "draft"), "comments": comments}
+    comments = run_stage(pipeline, "reviewed", reviewed_inputs, lambda: comments)
+
+    try:
+        improved_inputs = {"reviewed": get_stage_key(pipeline, "reviewed"), "model": model_config, "incremental": incremental_improve}
+        if not is_current(pipeline, "improved", improved_inputs):
+            job = tracked_job(runner, "improved")
+            # A job submitted on an earlier rerun is picked up as is; submitting again would
+            # start another one if it failed
+            if job is None or job.inputs != improved_inputs:
+                from stages import improve_draft
+                previous = job
+                llm = get_llm(providers, temp, refresh=bypass_cache)
+                job = runner.submit("improve", lambda job: improve_draft(
+                    job, draft, comments, llm, incremental_improve, max_concurrency
+                ), key=fingerprint(improved_inputs), inputs=improved_inputs, owner=session_owner())
+                # New comments supersede an improvement still running for the old ones
+                if previous is not None and previous.id != job.id:
+                    previous.release(session_owner())
+                track_job("improved", job)
+            if not job.done:
+                display_job_progress(job, "Final Proposal:", REQUIRED_KEYS, on_cancel=lambda: cancel_job("improved", job))
+                return
+            if job.status == DONE:
+                run_stage(pipeline, "improved", improved_inputs, lambda: job.result)
+                # Each new version replaces the one stored for the same draft
+                try:
+                    get_proposal_library().add(job.result, client_name, project_type, user_input, source_key=get_stage_key(pipeline, "draft"))
+                except sqlite3.Error as e:
+                    logging.warning(f"Could not store the proposal in the library: {str(e)}")
+            else:
+                # Kept as the stage's outcome, so later reruns show it instead of resubmitting
+                fail_stage(pipeline, "improved", improved_inputs,
+                           CANCELLED_MESSAGE if job.status == CANCELLED else f"An error occurred: {job.error}")
+                forget_job("improved")
+
+        error = get_stage_error(pipeline, "improved")
+        if error is not None:
+            if error == CANCELLED_MESSAGE:
+                st.info(error)
+            else:
+                st.error(error)
+            if st.button("Retry improvement"):
+                invalidate(pipeline, "improved")
+                st.rerun()
+            return
+        final_proposal = get_stage(pipeline, "improved")
+        display_proposal("Final Proposal:", final_proposal)
+
+        rendered_inputs = {"improved": get_stage_key(pipeline, "improved"), "client_name": client_name}
+        docx_bytes = run_stage(pipeline, "rendered", rendered_inputs, lambda: render_proposal(final_proposal, client_name))
+    except Exception as e:
+        st.error(f"An error occurred: {str(e)}")
+        return
+
+    # Provide download button with a unique key
+    st.download_button(
+        label="Download Proposal as DOCX",
+        data=docx_bytes,
+        file_name=f"Proposal_{client_name}.docx",
+        mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+        key="unique_download_button_key"
+    )
+
+    st.success("Proposal generated successfully!")
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    finally:
+        # Rendered last so it includes whatever ran during this rerun
+        display_trace_panel(get_tracer())
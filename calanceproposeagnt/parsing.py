@@ -0,0 +1,235 @@
+import ast
+import datetime
+import json
+import logging
+import re
+from langchain.schema.output_parser import StrOutputParser
+from llm_cache import stream_text
+from streaming import StreamAborted, Throttle, parse_partial_json
+from templates import SECTION_DESCRIPTIONS, get_reask_template
+from tracing import get_tracer
+
+MAX_REASKS = 1
+MAX_PROJECT_NAME_CHARS = 120
+PLACEHOLDER_VALUES = {"", "not provided", "n/a", "tbd", "..."}
+DATE_FORMATS = ["%Y-%m-%d", "%B %d, %Y", "%b %d, %Y", "%d %B %Y", "%m/%d/%Y", "%Y/%m/%d"]
+_FENCE_RE = re.compile(r"```(?:json|JSON)?\s*(.*?)(?:```|$)", re.DOTALL)
+# Valid JSON escapes, or a lone backslash (e.g. a Windows path or "\$" in pricing text)
+_ESCAPE_RE = re.compile(r'\\(["\\/bfnrt]|u[0-9a-fA-F]{4})|\\')
+_TRAILING_COMMA_RE = re.compile(r",(\s*[}\]])")
+
+class ParseError(ValueError):
+    pass
+
+def record(path):
+    # Counted per parse/repair path, so the sidebar and metrics show which ones models need
+    get_tracer().increment("parse", path)
+
+def _find_object(text):
+    # The outermost {...} in the text, ignoring braces inside strings; runs to the end if unclosed
+    start = text.find('{')
+    if start < 0:
+        return None
+    depth = 0
+    in_string = False
+    escaped = False
+    for index in range(start, len(text)):
+        char = text[index]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == '{':
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                return text[start:index + 1]
+    return text[start:]
+
+def extract_json_text(text):
+    """The JSON object in a completion, without code fences or text around it."""
+    fenced = _FENCE_RE.search(text)
+    if fenced and '{' in fenced.group(1):
+        text = fenced.group(1)
+    return _find_object(text)
+
+def _loads(text):
+    value = json.loads(text, strict=False)
+    if not isinstance(value, dict):
+        raise ParseError(f"Expected a JSON object, got {type(value).__name__}")
+    return value
+
+def parse_json_output(text):
+    """Parse the JSON object in a model completion, repairing common defects.
+
+    Repairs are tried cheapest first and each only if the previous form still fails:
+    extracting the object from fences or chatter, escaping stray backslashes, dropping
+    trailing commas, reading a Python-style dict, and finally salvaging the complete
+    fields of a truncated object. Returns ``(data, path)`` where ``path`` names the
+    repair that succeeded; raises ParseError when nothing can be recovered.
+    """
+    attempts = [("direct", lambda: text)]
+    extracted = extract_json_text(text)
+    if extracted is None:
+        raise ParseError("No JSON object found in the model output")
+    attempts.append(("extracted", lambda: extracted))
+    escaped = _ESCAPE_RE.sub(lambda match: match.group(0) if match.group(1) else "\\\\", extracted)
+    attempts.append(("escapes", lambda: escaped))
+    attempts.append(("trailing_commas", lambda: _TRAILING_COMMA_RE.sub(r"\1", escaped)))
+
+    for path, candidate in attempts:
+        try:
+            return _loads(candidate()), path
+        except (ValueError, ParseError):
+            continue
+
+    try:
+        value = ast.literal_eval(extracted)
+        if isinstance(value, dict):
+            return value, "python_literal"
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        pass
+
+    # Truncated output: keep the fields that were written in full. Unless the text ends
+    # on a closed value, the last field was cut off mid-value and is left for the re-ask.
+    partial = parse_partial_json(escaped)
+    if partial and not escaped.rstrip().endswith(('"', '}', ']')):
+        partial.pop(list(partial)[-1])
+    if partial:
+        return partial, "truncated"
+    raise ParseError("Model output is not valid JSON and could not be repaired")
+
+def _coerce_text(value):
+    # Models sometimes answer a prose section with a list or an object
+    if isinstance(value, list):
+        return "\n".join(f"- {_coerce_text(item)}" for item in value)
+    if isinstance(value, dict):
+        return "\n".join(f"{key}: {_coerce_text(item)}" for key, item in value.items())
+    return str(value)
+
+def _normalize_date(value):
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(value.strip(), date_format).strftime("%Y-%m-%d")
+        except ValueError:
+            continue
+    return None
+
+def validate_fields(data, keys):
+    """Check and normalize each expected field.
+
+    Returns ``(valid, problems)``: the usable values by key, and a reason for every
+    key that is missing or unusable. Non-string values are flattened to text, dates
+    are normalized to YYYY-MM-DD and project names cut to their first line.
+    """
+    valid = {}
+    problems = {}
+    for key in keys:
+        if key not in data or data[key] is None:
+            problems[key] = "missing"
+            continue
+        value = data[key]
+        if not isinstance(value, str):
+            value = _coerce_text(value)
+            record("coerced")
+        value = value.strip()
+        if value.lower() in PLACEHOLDER_VALUES:
+            problems[key] = "empty"
+            continue
+        if key == "date":
+            value = _normalize_date(value)
+            if value is None:
+                problems[key] = "not a date"
+                continue
+        elif key == "project_name":
+            value = value.splitlines()[0].strip(' "\'.*')
+            if not value or len(value) > MAX_PROJECT_NAME_CHARS:
+                problems[key] = "not a short project name"
+                continue
+        valid[key] = value
+    return valid, problems
+
+def reask_fields(llm, problems, context, on_update=None):
+    """Ask the model for just the listed fields; returns whatever comes back valid.
+
+    ``context`` is the text the model needs to write them, or a function of ``problems``
+    returning it. With ``on_update``, the answer is streamed and the partially parsed
+    fields are passed to it as they arrive; raising StreamAborted from it stops the call.
+    """
+    fields = "\n".join(
+        f"- {key}: {SECTION_DESCRIPTIONS.get(key, key)} (previous answer: {reason})" for key, reason in problems.items()
+    )
+    inputs = {
+        "context": context(problems) if callable(context) else context,
+        "fields": fields,
+        "keys": ", ".join(problems),
+    }
+    if on_update is None:
+        text = (get_reask_template() | llm | StrOutputParser()).invoke(inputs)
+    else:
+        pieces = []
+        throttle = Throttle()
+        for piece in stream_text(get_reask_template(), llm, inputs):
+            pieces.append(piece)
+            if throttle.ready():
+                on_update(parse_partial_json("".join(pieces)))
+        text = "".join(pieces)
+    data, _ = parse_json_output(text)
+    valid, _ = validate_fields(data, list(problems))
+    return valid
+
+def parse_proposal(text, keys, llm=None, context="", fallback=None, max_reasks=MAX_REASKS, on_update=None):
+    """Parse, repair and validate a proposal completion, re-asking only for what is missing.
+
+    Missing or invalid keys found in ``fallback`` take its values. With an ``llm``, up to
+    ``max_reasks`` follow-up calls request the rest (except the date, which is filled in
+    locally); ``on_update`` is passed on to ``reask_fields``. Returns the valid fields;
+    keys that could not be recovered are left out for the caller to default.
+    """
+    try:
+        data, path = parse_json_output(text)
+    except ParseError as e:
+        logging.error(f"Failed to parse model output: {str(e)}")
+        record("failed")
+        data, path = {}, None
+    if path:
+        record(path)
+        if path != "direct":
+            logging.warning(f"Model output needed repair: {path}")
+
+    valid, problems = validate_fields(data, keys)
+    for reason in problems.values():
+        record("missing" if reason == "missing" else "invalid")
+    for key in [key for key in problems if key in (fallback or {})]:
+        valid[key] = fallback[key]
+        problems.pop(key)
+        record("fallback")
+    if "date" in problems:
+        valid["date"] = datetime.date.today().strftime("%Y-%m-%d")
+        problems.pop("date")
+        record("date_defaulted")
+
+    for _ in range(max_reasks if llm is not None else 0):
+        if not problems:
+            break
+        logging.info(f"Re-asking the model for {len(problems)} fields: {', '.join(problems)}")
+        record("reask")
+        try:
+            recovered = reask_fields(llm, problems, context, on_update=on_update)
+        except StreamAborted:
+            raise
+        except Exception as e:
+            logging.error(f"Re-ask failed: {str(e)}")
+            record("reask_failed")
+            break
+        for key, value in recovered.items():
+            valid[key] = value
+            problems.pop(key)
+            record("reask_recovered")
+    return valid
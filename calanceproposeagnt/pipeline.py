@@ -0,0 +1,60 @@
+import hashlib
+import json
+import logging
+
+# Proposal stages in order; recomputing a stage invalidates every stage after it
+STAGES = ["draft", "reviewed", "improved", "rendered"]
+
+def fingerprint(inputs):
+    payload = json.dumps(inputs, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def is_current(state, stage, inputs):
+    entry = state.get(stage)
+    return entry is not None and entry["key"] == fingerprint(inputs)
+
+def get_stage(state, stage):
+    entry = state.get(stage)
+    return entry["value"] if entry is not None else None
+
+def get_stage_key(state, stage):
+    entry = state.get(stage)
+    return entry["key"] if entry is not None else None
+
+def invalidate(state, stage):
+    for later_stage in STAGES[STAGES.index(stage):]:
+        state.pop(later_stage, None)
+
+def run_stage(state, stage, inputs, compute):
+    """Return the stage's value, calling ``compute()`` only if its inputs changed.
+
+    ``state`` is a plain dict (in the app, ``st.session_state.pipeline``) mapping each
+    stage to the fingerprint of the inputs it was computed from and its value.
+    """
+    key = fingerprint(inputs)
+    entry = state.get(stage)
+    if entry is not None and entry["key"] == key:
+        return entry["value"]
+
+    logging.info(f"Running pipeline stage '{stage}'")
+    value = compute()
+    invalidate(state, stage)
+    state[stage] = {"key": key, "value": value}
+    return value
+
+def fail_stage(state, stage, inputs, error):
+    """Record that the stage failed for these inputs, like a result without a value.
+
+    ``is_current`` then holds for the same inputs, so the stage isn't retried on every
+    rerun; ``invalidate`` it to retry.
+    """
+    invalidate(state, stage)
+    state[stage] = {"key": fingerprint(inputs), "value": None, "error": error}
+
+def get_stage_error(state, stage):
+    entry = state.get(stage)
+    return entry.get("error") if entry is not None else None
+
+def current_stage(state):
+    completed = [stage for stage in STAGES if stage in state]
+    return completed[-1] if completed else None
@@ -1,61 +1,245 @@
 import logging
-from langchain.agents import create_react_agent, Tool
-from langchain_community.tools import DuckDuckGoSearchRun
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from context import get_model_name
+from langchain.agents import AgentExecutor, create_react_agent, Tool
 from langchain.prompts import PromptTemplate
+from response_store import ResponseStore
+from streaming import StreamAborted
+from tracing import span
 
-def refine_search_query(user_input, additional_info, llm):
+RESEARCH_CACHE_PATH = os.environ.get(
+    "RESEARCH_CACHE_PATH",
+    os.path.join(os.path.expanduser("~"), ".cache", "calance-proposal", "research.sqlite")
+)
+RESEARCH_CACHE_TTL_SECONDS = int(os.environ.get("RESEARCH_CACHE_TTL_SECONDS", 24 * 3600))
+RESEARCH_SEARCH_BACKEND = os.environ.get("RESEARCH_SEARCH_BACKEND", "duckduckgo")
+MAX_QUERIES = 3
+MAX_ITERATIONS = 4
+RESEARCH_TIMEOUT_SECONDS = float(os.environ.get("RESEARCH_TIMEOUT_SECONDS", 60))
+SEARCH_TIMEOUT_SECONDS = float(os.environ.get("RESEARCH_SEARCH_TIMEOUT_SECONDS", 15))
+# Cap on how much of the requirements goes into the query-refinement prompt
+MAX_QUERY_CONTEXT_CHARS = 4000
+
+class SearchBackend:
+    name = "base"
+
+    def search(self, query):
+        raise NotImplementedError
+
+class DuckDuckGoBackend(SearchBackend):
+    name = "duckduckgo"
+
+    def __init__(self):
+        from langchain_community.tools import DuckDuckGoSearchRun
+        self._search = DuckDuckGoSearchRun()
+
+    def search(self, query):
+        return self._search.run(query)
+
+class OfflineCorpusBackend(SearchBackend):
+    """Keyword search over local text, standing in for web search in tests and offline use."""
+
+    name = "offline"
+
+    def __init__(self, documents, max_results=3):
+        self.documents = documents
+        self.max_results = max_results
+
+    @classmethod
+    def from_directory(cls, path):
+        documents = []
+        for file_name in sorted(os.listdir(path)):
+            if file_name.endswith(('.txt', '.md')):
+                with open(os.path.join(path, file_name), 'r', encoding='utf-8') as f:
+                    documents.append(f.read())
+        return cls(documents)
+
+    def search(self, query):
+        terms = set(re.findall(r"[a-z0-9]+", query.lower()))
+        scored = []
+        for document in self.documents:
+            words = re.findall(r"[a-z0-9]+", document.lower())
+            score = sum(1 for word in words if word in terms)
+            if score:
+                scored.append((score, document))
+        scored.sort(key=lambda item: -item[0])
+        if not scored:
+            return "No good search result found"
+        return "\n\n".join(document for _, document in scored[:self.max_results])
+
+def get_search_backend(spec=RESEARCH_SEARCH_BACKEND):
+    # "duckduckgo", "offline:<directory of .txt/.md files>" or "fake" (canned results, for benchmarks)
+    if spec.startswith("offline:"):
+        return OfflineCorpusBackend.from_directory(spec.split(":", 1)[1])
+    if spec == "fake":
+        from fakes import FakeSearchBackend
+        return FakeSearchBackend()
+    return DuckDuckGoBackend()
+
+def normalize_query(query):
+    return " ".join(re.findall(r"[a-z0-9]+", query.lower()))
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_research_cache():
+    # Search results and agent conclusions share one SQLite store, namespaced by kind
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseStore(RESEARCH_CACHE_PATH, ttl_seconds=RESEARCH_CACHE_TTL_SECONDS)
+        return _cache
+
+class CachedSearch:
+    """Search backend wrapper that reuses results for the same normalized query."""
+
+    def __init__(self, backend, cache):
+        self.backend = backend
+        self.cache = cache
+
+    def run(self, query):
+        key = ResponseStore.make_key("search", self.backend.name, normalize_query(query))
+        result = self.cache.get(key)
+        if result is None:
+            result = self.backend.search(query)
+            self.cache.put(key, "search", result)
+        return result
+
+def _response_text(response):
+    return response.content if hasattr(response, 'content') else str(response)
+
+def refine_search_queries(user_input, additional_info, llm, max_queries=MAX_QUERIES):
     prompt = f"""
-    Analyze the following content and derive the best search string to best research what is expressed in this statement:
-    "Based on: {user_input}; Additional_info: {additional_info}"
+    Analyze the following content and derive up to {max_queries} distinct web search strings that together best research what is expressed in this statement:
+    "Based on: {user_input[:MAX_QUERY_CONTEXT_CHARS]}; Additional_info: {additional_info}"
+    Return one search string per line, without numbering or commentary.
     """
-    response = llm.invoke(prompt)
-    refined_query = response.strip()
-    return refined_query
+    response = _response_text(llm.invoke(prompt))
+    queries = []
+    for line in response.splitlines():
+        query = re.sub(r"^\s*(?:[-*•]|\d+[.)])\s*", "", line).strip().strip('"')
+        if query and normalize_query(query) not in {normalize_query(q) for q in queries}:
+            queries.append(query)
+    return queries[:max_queries] or [response.strip()]
+
+def refine_search_query(user_input, additional_info, llm):
+    return refine_search_queries(user_input, additional_info, llm, max_queries=1)[0]
+
+def prefetch_search_results(search, queries, timeout=SEARCH_TIMEOUT_SECONDS):
+    # Run the refined queries in parallel; slow searches are left out rather than waited for
+    executor = ThreadPoolExecutor(max_workers=len(queries))
+    futures = {executor.submit(search.run, query): query for query in queries}
+    done, not_done = wait(futures, timeout=timeout)
+    executor.shutdown(wait=False, cancel_futures=True)
+    results = {}
+    for future in done:
+        try:
+            results[futures[future]] = future.result()
+        except Exception as e:
+            logging.warning(f"Search for '{futures[future]}' failed: {str(e)}")
+    for future in not_done:
+        logging.warning(f"Search for '{futures[future]}' timed out after {timeout} seconds")
+    return results
+
+REACT_PROMPT = PromptTemplate(
+    input_variables=["input", "tools", "tool_names", "agent_scratchpad"],
+    template="""
+    Research the question below for a project proposal. It includes initial search results; search again only if they are not enough.
 
-def perform_research(user_input, additional_info, llm):
+    You have access to the following tools:
+    {tools}
+
+    Use the following format:
+
+    Question: the input question you must answer
+    Thought: you should always think about what to do
+    Action: the action to take, should be one of [{tool_names}]
+    Action Input: the input to the action
+    Observation: the result of the action
+    ... (this Thought/Action/Action Input/Observation can repeat N times)
+    Thought: I now know the final answer
+    Final Answer: the final answer to the original input question
+
+    Begin!
+
+    Question: {input}
+    Thought: {agent_scratchpad}
+    """
+)
+
+def perform_research(user_input, additional_info, llm, backend=None, cache=None,
+                     max_iterations=MAX_ITERATIONS, timeout=RESEARCH_TIMEOUT_SECONDS, check_cancelled=None):
+    # check_cancelled is called before the searches, the agent and each agent search;
+    # StreamAborted raised from it stops the research and is passed on to the caller
     try:
-        refined_query = refine_search_query(user_input, additional_info, llm)
-        search = DuckDuckGoSearchRun()
-        tools = [
-            Tool(
-                name="Search",
-                func=search.run,
-                description="useful for when you need to answer questions about current events"
-            )
-        ]
-        prompt_template = PromptTemplate(
-            input_variables=["user_input", "additional_info", "tools", "tool_names", "agent_scratchpad"],
-            template="""
-            Based on: {user_input} and additional info: {additional_info}
-            
-            You have access to the following tools:
-            {tool_names}
-
-            Use the following format:
-
-            Question: the input question you must answer
-            Thought: you should always think about what to do
-            Action: the action to take, should be one of {tool_names}
-            Action Input: the input to the action
-            Observation: the result of the action
-            ... (this Thought/Action/Action Input/Observation can repeat N times)
-            Thought: I now know the final answer
-            Final Answer: the final answer to the original input question
-
-            Begin!
-
-            {agent_scratchpad}
-            """
-        )
-        agent = create_react_agent(tools, llm, prompt=prompt_template)
-        agent_executor = AgentExecutor.from_agent_and_tools(
-            agent=agent,
-            tools=tools,
-            verbose=True,
-            handle_parsing_errors=True
-        )
-        research_result = agent_executor.run(refined_query)
-        return {"status": "success", "data": research_result}
+        with span("research") as record:
+            return _perform_research(user_input, additional_info, llm, backend, cache, max_iterations, timeout,
+                                     check_cancelled or (lambda: None), record)
+    except StreamAborted:
+        raise
     except Exception as e:
         logging.error(f"Research error: {str(e)}")
         return {"status": "error", "message": f"Unable to complete research due to an error: {str(e)}"}
+
+def _perform_research(user_input, additional_info, llm, backend, cache, max_iterations, timeout, check_cancelled, record):
+    started = time.monotonic()
+    cache = cache or get_research_cache()
+    search = CachedSearch(backend or get_search_backend(), cache)
+    with span("research.queries"):
+        queries = refine_search_queries(user_input, additional_info, llm)
+
+    # Reuse a previous conclusion for the same queries and model
+    llm_string = f"{type(getattr(llm, 'runnable', llm)).__name__}:{get_model_name(llm)}"
+    answer_key = ResponseStore.make_key("research", llm_string, normalize_query(" | ".join(sorted(queries))))
+    cached_answer = cache.get(answer_key)
+    record["attributes"]["cached"] = cached_answer is not None
+    if cached_answer is not None:
+        return {"status": "success", "data": cached_answer}
+
+    check_cancelled()
+    with span("research.search", queries=len(queries)):
+        results = prefetch_search_results(search, queries, timeout=min(SEARCH_TIMEOUT_SECONDS, timeout))
+    question = "\n\n".join(
+        [f"Research topics: {'; '.join(queries)}", f"Additional info: {additional_info}"]
+        + [f"Initial search results for '{query}':\n{result}" for query, result in results.items()]
+    )
+
+    def run_search(query):
+        check_cancelled()
+        return search.run(query)
+
+    check_cancelled()
+    tools = [
+        Tool(
+            name="Search",
+            func=run_search,
+            description="useful for when you need to answer questions about current events"
+        )
+    ]
+    agent = create_react_agent(llm, tools, REACT_PROMPT)
+    agent_executor = AgentExecutor.from_agent_and_tools(
+        agent=agent,
+        tools=tools,
+        verbose=True,
+        handle_parsing_errors=True,
+        max_iterations=max_iterations,
+        max_execution_time=max(1.0, timeout - (time.monotonic() - started)),
+        early_stopping_method="force"
+    )
+    with span("research.agent") as agent_record:
+        research_result = agent_executor.invoke({"input": question})["output"]
+        stopped_early = research_result.startswith("Agent stopped due to")
+        agent_record["attributes"]["stopped_early"] = stopped_early
+    if stopped_early:
+        # Out of time or iterations: the prefetched results are still useful research, but not
+        # worth caching as the conclusion for these queries
+        if not results:
+            return {"status": "error", "message": "Research stopped before finding any search results."}
+        research_result = "\n\n".join(results.values())
+    else:
+        cache.put(answer_key, "research", research_result)
+    return {"status": "success", "data": research_result}
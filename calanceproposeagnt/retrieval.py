@@ -0,0 +1,167 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import zlib
+from collections import OrderedDict
+import numpy as np
+from context import CHUNK_TOKENS, chunk_text, tokenize
+
+N_FEATURES = 2 ** 13
+TOP_K = int(os.environ.get("RETRIEVAL_TOP_K", 4))
+INDEX_DIR = os.environ.get("RETRIEVAL_INDEX_DIR")
+MAX_CACHED_INDEXES = 8
+
+# What each proposal section needs from the uploaded documents
+SECTION_QUERIES = {
+    "description": "project overview background summary agreement client organization",
+    "purpose": "purpose goals objectives business need problem outcomes benefits",
+    "scope": "scope requirements functional non-functional features deliverables in scope out of scope",
+    "approach": "approach methodology architecture technology framework platform delivery agile design",
+    "engagement_approach": "engagement model time materials fixed price staffing roles team governance",
+    "project_estimated_timeline": "timeline schedule milestones phases deadline duration weeks months start date",
+    "development_hosting_support_maintenance_estimates": "cost estimate budget pricing hours rates hosting support maintenance licensing",
+    "risks_constraints_dependencies": "risks constraints dependencies assumptions compliance security issues mitigation",
+}
+
+def _feature(token):
+    # crc32 rather than hash(): Python's string hash is salted per process, which would break persisted indexes
+    h = zlib.crc32(token.encode('utf-8'))
+    return h % N_FEATURES, (1.0 if (h >> 31) & 1 else -1.0)
+
+def term_vector(text):
+    vector = np.zeros(N_FEATURES, dtype=np.float32)
+    tokens = tokenize(text)
+    for token in tokens + [f"{a}_{b}" for a, b in zip(tokens, tokens[1:])]:
+        index, sign = _feature(token)
+        vector[index] += sign
+    return vector
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+class VectorIndex:
+    """Hashed TF-IDF vectors for document chunks, searchable by cosine similarity."""
+
+    def __init__(self, chunks, vectors, idf):
+        self.chunks = chunks
+        self.vectors = vectors
+        self.idf = idf
+        self.texts = {chunk["text"] for chunk in chunks}
+
+    @classmethod
+    def build(cls, sources, chunk_tokens=CHUNK_TOKENS):
+        chunks = []
+        for source_name, text in sources:
+            for chunk_index, chunk in enumerate(chunk_text(text, chunk_tokens)):
+                chunks.append({"source": source_name, "chunk_index": chunk_index, "text": chunk})
+        if not chunks:
+            return cls([], np.zeros((0, N_FEATURES), dtype=np.float32), np.ones(N_FEATURES, dtype=np.float32))
+
+        counts = np.stack([term_vector(chunk["text"]) for chunk in chunks])
+        document_frequency = np.count_nonzero(counts, axis=0)
+        idf = (np.log((1 + len(chunks)) / (1 + document_frequency)) + 1).astype(np.float32)
+        vectors = _normalize(np.sign(counts) * np.log1p(np.abs(counts)) * idf).astype(np.float32)
+        return cls(chunks, vectors, idf)
+
+    def embed(self, text):
+        counts = term_vector(text)
+        return _normalize(np.sign(counts) * np.log1p(np.abs(counts)) * self.idf)
+
+    def search(self, query, k=TOP_K):
+        if not self.chunks:
+            return []
+        scores = self.vectors @ self.embed(query)
+        top = np.argsort(-scores)[:k]
+        return [dict(self.chunks[i], score=float(scores[i])) for i in top if scores[i] > 0]
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "vectors.npy"), self.vectors)
+        np.save(os.path.join(path, "idf.npy"), self.idf)
+        with open(os.path.join(path, "chunks.json"), 'w', encoding='utf-8') as f:
+            json.dump(self.chunks, f)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        # Memory-mapped vectors are paged in on demand and shared between processes by the OS
+        vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode='r' if mmap else None)
+        idf = np.load(os.path.join(path, "idf.npy"))
+        with open(os.path.join(path, "chunks.json"), 'r', encoding='utf-8') as f:
+            chunks = json.load(f)
+        return cls(chunks, vectors, idf)
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+def _sources_key(sources):
+    digest = hashlib.sha256(f"{N_FEATURES}:{CHUNK_TOKENS}".encode('utf-8'))
+    for source_name, text in sources:
+        digest.update(source_name.encode('utf-8') + b"\0" + text.encode('utf-8') + b"\0")
+    return digest.hexdigest()
+
+def get_index(sources, index_dir=INDEX_DIR):
+    # Indexes are reused across reruns in memory and, when index_dir is set, across restarts on disk
+    key = _sources_key(sources)
+    with _indexes_lock:
+        if key in _indexes:
+            _indexes.move_to_end(key)
+            return _indexes[key]
+
+    path = os.path.join(index_dir, key) if index_dir else None
+    index = None
+    if path and os.path.exists(os.path.join(path, "chunks.json")):
+        try:
+            index = VectorIndex.load(path)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Could not load retrieval index {key}: {str(e)}")
+    if index is None:
+        index = VectorIndex.build(sources)
+        if path:
+            try:
+                index.save(path)
+            except OSError as e:
+                logging.warning(f"Could not persist retrieval index {key}: {str(e)}")
+
+    with _indexes_lock:
+        _indexes[key] = index
+        while len(_indexes) > MAX_CACHED_INDEXES:
+            _indexes.popitem(last=False)
+    return index
+
+def retrieve_section_evidence(index, requirements, k=TOP_K):
+    # Each section query is biased towards the user's requirements so evidence stays on topic
+    return {
+        section: index.search(f"{query} {requirements}", k)
+        for section, query in SECTION_QUERIES.items()
+    }
+
+def build_evidence_scorer(index, requirements, k=TOP_K):
+    """Return ``(scorer, evidence)`` for use with ``context.assemble_context``.
+
+    Indexed chunks score above 1 only if they are in some section's top-k, so
+    ``min_score=1.0`` keeps everything else out of the prompt. Text that is not in
+    the index (such as the research result) is always eligible and ranked by
+    similarity to the requirements.
+    """
+    evidence = retrieve_section_evidence(index, requirements, k)
+    selected = {}
+    for hits in evidence.values():
+        for hit in hits:
+            selected[hit["text"]] = max(selected.get(hit["text"], 0.0), hit["score"])
+    requirements_vector = index.embed(requirements) if requirements else None
+
+    def scorer(chunk):
+        if chunk in selected:
+            return 1.0 + selected[chunk]
+        if chunk in index.texts:
+            return 0.0
+        if requirements_vector is None:
+            return 1.0
+        # Signed feature hashing can make unrelated text score below 0; it stays eligible
+        return 1.0 + max(0.0, float(np.dot(index.embed(chunk), requirements_vector)))
+
+    return scorer, evidence
@@ -1,13 +1,16 @@
 import streamlit as st
-import uuid
 
-def review_and_comment(proposal_content):
+def review_and_comment(proposal_content, key_prefix="comment"):
+    # Comments are collected in a form so they reach the app together on submit rather than
+    # one rerun per text area. Stable keys keep them across reruns; pass a new key_prefix
+    # to start with empty comments (e.g. for a new draft).
     st.subheader("Review and Comment on the Draft Proposal")
     comments = {}
-    for section, content in proposal_content.items():
-        st.write(f"**{section.replace('_', ' ').title()}**")
-        st.write(content)
-        unique_key = f"comment_{section}_{uuid.uuid4()}"  # Use UUID for uniqueness
-        comment = st.text_area(f"Comments for {section}:", key=unique_key)
-        comments[section] = comment
+    with st.form(f"{key_prefix}_form"):
+        for section, content in proposal_content.items():
+            st.write(f"**{section.replace('_', ' ').title()}**")
+            st.write(content)
+            comment = st.text_area(f"Comments for {section}:", key=f"{key_prefix}_{section}")
+            comments[section] = comment
+        st.form_submit_button("Apply comments")
     return comments
@@ -0,0 +1,55 @@
+"""The draft and improve stages, run by main.py as background jobs.
+
+They report to the job instead of drawing on the page. This module pulls in LangChain
+agents, search and retrieval, so main.py imports it only when a job is submitted.
+"""
+import json
+import logging
+from generation import ensure_required_keys, generate_proposal, generate_proposal_by_section, prepare_generation_inputs
+from improve import improve_proposal, improve_sections
+from library import get_proposal_library
+from tracing import traced
+
+@traced("pipeline.draft")
+def draft_proposal(job, llm, client_name, project_type, requirements, documents, additional_info,
+                   context_budget, section_mode, max_concurrency, reuse_library):
+    inputs = prepare_generation_inputs(
+        llm, requirements, documents, additional_info, context_budget,
+        library=get_proposal_library() if reuse_library else None, project_type=project_type
+    )
+    context = inputs["context"]
+    job.add_detail("research_warning", inputs["research_warning"])
+    job.add_detail("section_evidence", inputs["section_evidence"] if documents else None)
+    job.add_detail("exemplars", inputs["exemplars"])
+    job.add_detail("adapted", sorted(inputs["section_drafts"]) if section_mode else [])
+    job.add_detail("context", {"tokens": context["tokens"], "budget": context["budget"], "dropped": context["dropped"]})
+
+    # Generate the proposal; sections show up on the page as they stream in
+    if section_mode:
+        result = generate_proposal_by_section(
+            llm, client_name, project_type, inputs["user_input"], additional_info,
+            section_context=inputs["section_context"],
+            section_drafts=inputs["section_drafts"],
+            max_concurrency=max_concurrency,
+            on_update=job.update_section
+        )
+    else:
+        result = generate_proposal(llm, client_name, project_type, inputs["user_input"], additional_info, on_update=job.update)
+    job.update(result)
+    return result
+
+@traced("pipeline.improve")
+def improve_draft(job, draft, comments, llm, incremental, max_concurrency):
+    # Improve the proposal based on comments, streaming the rewrite
+    if incremental:
+        # Only commented sections are rewritten; the rest of the draft is shown as is
+        job.update(draft)
+        final_proposal = improve_sections(draft, comments, llm, max_concurrency=max_concurrency, on_update=job.update_section)
+    else:
+        final_proposal = improve_proposal(draft, comments, llm, on_update=job.update)
+
+    # Ensure all required keys are present in the final proposal
+    ensure_required_keys(final_proposal)
+    job.update(final_proposal)
+    logging.info(f"Final proposal structure: {json.dumps(final_proposal, indent=2)}")
+    return final_proposal
@@ -0,0 +1,90 @@
+import json
+import re
+import time
+from json.decoder import scanstring
+
+# Shortest interval between UI refreshes while tokens arrive; re-rendering per token is slower than the model
+UPDATE_INTERVAL = 0.15
+_WHITESPACE = " \t\r\n"
+_DANGLING_UNICODE_ESCAPE = re.compile(r'(?<!\\)\\u[0-9a-fA-F]{0,3}$')
+_decoder = json.JSONDecoder(strict=False)
+
+def _read_string(text, index):
+    # Returns (value, end, closed) for the JSON string whose opening quote is at text[index]
+    try:
+        value, end = scanstring(text, index + 1, False)
+        return value, end, True
+    except json.JSONDecodeError:
+        partial = text[index + 1:]
+        trailing_backslashes = len(partial) - len(partial.rstrip('\\'))
+        if trailing_backslashes % 2:
+            partial = partial[:-1]
+        partial = _DANGLING_UNICODE_ESCAPE.sub('', partial)
+        try:
+            value, _ = scanstring(partial + '"', 0, False)
+        except json.JSONDecodeError:
+            value = partial
+        return value, len(text), False
+
+def _skip(text, index, characters):
+    while index < len(text) and text[index] in characters:
+        index += 1
+    return index
+
+def parse_partial_json(text):
+    """Best-effort parse of a JSON object that may still be streaming in.
+
+    Leading chatter and code fences are ignored. Complete key/value pairs are
+    returned as parsed; a string value that has not been closed yet is returned
+    with the text received so far, so sections can be shown while being written.
+    """
+    index = text.find('{')
+    if index < 0:
+        return {}
+    result = {}
+    index += 1
+    while True:
+        index = _skip(text, index, _WHITESPACE + ',')
+        if index >= len(text) or text[index] != '"':
+            break
+        key, index, closed = _read_string(text, index)
+        if not closed:
+            break
+        index = _skip(text, index, _WHITESPACE)
+        if index >= len(text) or text[index] != ':':
+            break
+        index = _skip(text, index + 1, _WHITESPACE)
+        if index >= len(text):
+            break
+        if text[index] == '"':
+            value, index, closed = _read_string(text, index)
+            result[key] = value
+            if not closed:
+                break
+        else:
+            try:
+                value, index = _decoder.raw_decode(text, index)
+            except json.JSONDecodeError:
+                break
+            result[key] = value
+    return result
+
+class StreamAborted(Exception):
+    # Raised by an on_update callback to stop a stream; never retried
+    pass
+
+def message_text(chunk):
+    # Chat models stream message chunks, completion models stream plain strings
+    return chunk.content if hasattr(chunk, 'content') else str(chunk)
+
+class Throttle:
+    def __init__(self, interval=UPDATE_INTERVAL):
+        self.interval = interval
+        self._last = 0.0
+
+    def ready(self):
+        now = time.monotonic()
+        if now - self._last >= self.interval:
+            self._last = now
+            return True
+        return False
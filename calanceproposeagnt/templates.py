@@ -1,7 +1,39 @@
-from langchain.prompts import ChatPromptTemplate
+from functools import lru_cache
+
+# Proposal sections in document order, with the guidance given to the model for each
+SECTION_DESCRIPTIONS = {
+    "date": "The date of the proposal",
+    "project_name": "The name of the project",
+    "description": "Brief description of the project and agreement",
+    "purpose": "The purpose of the project",
+    "scope": "Detailed scope of the project, including functional and non-functional requirements",
+    "approach": "The approach to be used for the project, including technological framework and delivery framework",
+    "engagement_approach": "Details on the engagement approach, such as Time & Materials",
+    "project_estimated_timeline": "Estimated timeline for the project",
+    "development_hosting_support_maintenance_estimates": "Estimates for development, hosting, support, and maintenance",
+    "risks_constraints_dependencies": "Identified risks, constraints, and dependencies for the project",
+}
+REQUIRED_KEYS = list(SECTION_DESCRIPTIONS)
+
+# Templates and schemas are built once per process and shared; they are never mutated.
+# LangChain is only imported when the first one is built, so the section list above is cheap to import.
+
+def _chat_template(text):
+    from langchain_core.prompts import ChatPromptTemplate
+    return ChatPromptTemplate.from_template(text)
+
+@lru_cache(maxsize=None)
+def get_response_schemas():
+    from langchain.output_parsers import ResponseSchema
+    return [ResponseSchema(name=name, description=description) for name, description in SECTION_DESCRIPTIONS.items()]
 
 def get_prompt_template(client_name, project_type, user_input, additional_info, format_instructions):
-    return ChatPromptTemplate.from_template(
+    # The values are filled in at invoke time; the arguments are kept for existing callers
+    return _get_proposal_template()
+
+@lru_cache(maxsize=None)
+def _get_proposal_template():
+    return _chat_template(
         """You are an expert proposal writer for Calance. Based on the following information, generate a comprehensive proposal:
 
         Client Name: {client_name}
@@ -13,3 +45,76 @@ def get_prompt_template(client_name, project_type, user_input, additional_info,
 
         Ensure the proposal is professional, well-structured, and tailored to the client's needs. Include all sections as specified in the format instructions, paying special attention to the risks, constraints, and dependencies section."""
     )
+
+@lru_cache(maxsize=None)
+def get_section_prompt_template():
+    return _chat_template(
+        """You are an expert proposal writer for Calance. You are writing one section of a proposal:
+
+        Client Name: {client_name}
+        Project Type: {project_type}
+        Project Requirements: {user_input}
+        Additional Information: {additional_info}
+
+        Section: {section_title}
+        The section should contain: {section_description}
+
+        Write only the content of this section as plain text, without the section heading, without JSON and without commentary. Ensure it is professional and tailored to the client's needs."""
+    )
+
+@lru_cache(maxsize=None)
+def get_section_adaptation_template():
+    return _chat_template(
+        """You are an expert proposal writer for Calance. A proposal we wrote for a very similar project already has this section. Adapt it to the new proposal:
+
+        Client Name: {client_name}
+        Project Type: {project_type}
+        Project Requirements: {user_input}
+        Additional Information: {additional_info}
+
+        Section: {section_title}
+        The section should contain: {section_description}
+        Section From The Earlier Proposal: {prior_section}
+
+        Return only the adapted content of this section as plain text, without the section heading, without JSON and without commentary. Keep what applies unchanged, replace anything specific to the earlier client or project, and add what the new requirements need."""
+    )
+
+@lru_cache(maxsize=None)
+def get_improvement_template():
+    return _chat_template(
+        """You are an expert proposal reviewer. Improve the following proposal sections based on the comments provided:
+
+        {proposal_content}
+        Comments: {comments}
+
+        Ensure the improvements are professional and address the comments effectively. Return the improved proposal as a JSON object with the same structure as the original proposal. Make sure to include all required sections: date, project_name, description, purpose, scope, approach, engagement_approach, project_estimated_timeline, development_hosting_support_maintenance_estimates, and risks_constraints_dependencies."""
+    )
+
+@lru_cache(maxsize=None)
+def get_section_improvement_template():
+    return _chat_template(
+        """You are an expert proposal reviewer for Calance. Revise one section of a proposal based on the reviewer's comment:
+
+        Project: {project_name}
+        Project Description: {project_description}
+
+        Section: {section_title}
+        The section should contain: {section_description}
+        Current Content: {section_content}
+        Reviewer Comment: {comment}
+
+        Return only the revised content of this section as plain text, without the section heading, without JSON and without commentary. Keep what the comment does not ask to change, and ensure the result is professional."""
+    )
+
+@lru_cache(maxsize=None)
+def get_reask_template():
+    return _chat_template(
+        """You are an expert proposal writer for Calance. A previous answer for this proposal left some sections missing or unusable.
+
+        {context}
+
+        Write only these sections:
+        {fields}
+
+        Return a JSON object with exactly these keys: {keys}. Each value must be a non-empty string. Do not include any other keys or commentary."""
+    )
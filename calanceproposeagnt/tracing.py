@@ -0,0 +1,293 @@
+import contextvars
+import functools
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from langchain_core.callbacks import BaseCallbackHandler
+from context import count_tokens
+
+# Append every finished span and LLM call to this file as JSON lines
+TRACE_LOG_PATH = os.environ.get("TRACE_LOG_PATH")
+# Recent records kept in memory for the sidebar panel and exports
+MAX_RECORDS = int(os.environ.get("TRACE_MAX_RECORDS", 2000))
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+def _new_id():
+    return uuid.uuid4().hex[:16]
+
+class Tracer:
+    """Collects timed spans and LLM call records, with running totals for export.
+
+    Spans nest through a context variable, so a span opened inside another (in the
+    same thread or asyncio task) shares its trace ID and records its parent. The
+    totals only ever grow, which is what Prometheus expects of counters.
+    """
+
+    def __init__(self, max_records=MAX_RECORDS, log_path=TRACE_LOG_PATH):
+        self.records = deque(maxlen=max_records)
+        self.log_path = log_path
+        self.stages = {}
+        self.llm = {}
+        self.events = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name, **attributes):
+        parent = _current_span.get()
+        record = {
+            "type": "span",
+            "name": name,
+            "trace_id": parent["trace_id"] if parent else _new_id(),
+            "span_id": _new_id(),
+            "parent_id": parent["span_id"] if parent else None,
+            "start": time.time(),
+            "attributes": attributes,
+        }
+        token = _current_span.set(record)
+        started = time.perf_counter()
+        try:
+            yield record
+        except Exception as e:
+            record["error"] = str(e)
+            raise
+        finally:
+            record["duration"] = time.perf_counter() - started
+            _current_span.reset(token)
+            self._finish_span(record)
+
+    def _finish_span(self, record):
+        with self._lock:
+            stage = self.stages.setdefault(record["name"], {"count": 0, "errors": 0, "seconds": 0.0, "max_seconds": 0.0, "last_seconds": 0.0})
+            stage["count"] += 1
+            stage["errors"] += 1 if "error" in record else 0
+            stage["seconds"] += record["duration"]
+            stage["max_seconds"] = max(stage["max_seconds"], record["duration"])
+            stage["last_seconds"] = record["duration"]
+        self._append(record)
+
+    def record_llm_call(self, record):
+        with self._lock:
+            model = self._model_totals(record["name"])
+            model["calls"] += 1
+            model["errors"] += 1 if "error" in record else 0
+            model["seconds"] += record["duration"]
+            model["prompt_tokens"] += record.get("prompt_tokens", 0)
+            model["completion_tokens"] += record.get("completion_tokens", 0)
+            if record.get("time_to_first_token") is not None:
+                model["ttft_count"] += 1
+                model["ttft_seconds"] += record["time_to_first_token"]
+        self._append(record)
+
+    def record_retry(self, model):
+        with self._lock:
+            self._model_totals(model)["retries"] += 1
+
+    def increment(self, kind, name):
+        # Occurrence counts, e.g. which repair path parsing a completion needed
+        with self._lock:
+            self.events[(kind, name)] = self.events.get((kind, name), 0) + 1
+
+    def _model_totals(self, model):
+        if model not in self.llm:
+            self.llm[model] = {
+                "calls": 0, "errors": 0, "retries": 0, "seconds": 0.0,
+                "prompt_tokens": 0, "completion_tokens": 0, "ttft_count": 0, "ttft_seconds": 0.0
+            }
+        return self.llm[model]
+
+    def _append(self, record):
+        with self._lock:
+            self.records.append(record)
+            if self.log_path:
+                try:
+                    with open(self.log_path, 'a', encoding='utf-8') as f:
+                        f.write(json.dumps(record, default=str) + "\n")
+                except OSError as e:
+                    logging.warning(f"Could not write trace log: {str(e)}")
+
+    def clear(self):
+        with self._lock:
+            self.records.clear()
+            self.stages.clear()
+            self.llm.clear()
+            self.events.clear()
+
+    def to_jsonl(self):
+        with self._lock:
+            return "".join(json.dumps(record, default=str) + "\n" for record in self.records)
+
+    def to_prometheus(self):
+        with self._lock:
+            stages = {name: dict(values) for name, values in self.stages.items()}
+            models = {name: dict(values) for name, values in self.llm.items()}
+            events = dict(self.events)
+
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for suffix, labels, value in samples:
+                label_text = ",".join(f'{key}="{_escape_label(label)}"' for key, label in labels.items())
+                lines.append(f"{name}{suffix}{{{label_text}}} {value}")
+
+        metric("proposal_stage_duration_seconds", "summary", "Time spent in each pipeline stage.",
+               [s for name, stage in stages.items() for s in (
+                   ("_count", {"stage": name}, stage["count"]),
+                   ("_sum", {"stage": name}, round(stage["seconds"], 6)))])
+        metric("proposal_stage_errors_total", "counter", "Pipeline stage runs that raised.",
+               [("", {"stage": name}, stage["errors"]) for name, stage in stages.items()])
+        metric("proposal_llm_duration_seconds", "summary", "LLM call latency.",
+               [s for name, model in models.items() for s in (
+                   ("_count", {"model": name}, model["calls"]),
+                   ("_sum", {"model": name}, round(model["seconds"], 6)))])
+        metric("proposal_llm_time_to_first_token_seconds", "summary", "Time to the first streamed token.",
+               [s for name, model in models.items() for s in (
+                   ("_count", {"model": name}, model["ttft_count"]),
+                   ("_sum", {"model": name}, round(model["ttft_seconds"], 6)))])
+        metric("proposal_llm_tokens_total", "counter", "Prompt and completion tokens.",
+               [s for name, model in models.items() for s in (
+                   ("", {"model": name, "kind": "prompt"}, model["prompt_tokens"]),
+                   ("", {"model": name, "kind": "completion"}, model["completion_tokens"]))])
+        metric("proposal_llm_retries_total", "counter", "LLM calls retried after a failure.",
+               [("", {"model": name}, model["retries"]) for name, model in models.items()])
+        metric("proposal_llm_errors_total", "counter", "LLM calls that failed.",
+               [("", {"model": name}, model["errors"]) for name, model in models.items()])
+        metric("proposal_events_total", "counter", "Occurrences of notable events, such as output repairs.",
+               [("", {"kind": kind, "name": name}, count) for (kind, name), count in sorted(events.items())])
+        return "\n".join(lines) + "\n"
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _usage_from(response):
+    # Providers report usage in different places; returns (prompt, completion) or None
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    if "prompt_tokens" in usage:
+        return usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+    for generations in response.generations:
+        for generation in generations:
+            metadata = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if metadata:
+                return metadata.get("input_tokens", 0), metadata.get("output_tokens", 0)
+            info = generation.generation_info or {}
+            if "prompt_eval_count" in info:
+                # Ollama
+                return info.get("prompt_eval_count") or 0, info.get("eval_count") or 0
+    return None
+
+class LLMMetricsHandler(BaseCallbackHandler):
+    """LangChain callback recording latency, time to first token, tokens and retries per call.
+
+    Token counts come from the provider's usage report where there is one, otherwise
+    they are estimated from the prompt and completion text (``tokens_estimated``).
+    """
+
+    run_inline = True
+
+    def __init__(self, tracer):
+        self.tracer = tracer
+        self._runs = {}
+        self._lock = threading.Lock()
+
+    def _start(self, run_id, prompt_text, tags, metadata, kwargs):
+        params = kwargs.get("invocation_params") or {}
+        model = (metadata or {}).get("ls_model_name") or params.get("model_name") or params.get("model") or params.get("_type", "unknown")
+        parent = _current_span.get()
+        attempt = next((int(tag.rsplit(":", 1)[1]) for tag in tags or [] if tag.startswith("retry:attempt:")), 1)
+        if attempt > 1:
+            self.tracer.record_retry(model)
+        with self._lock:
+            self._runs[run_id] = {
+                "type": "llm",
+                "name": model,
+                "trace_id": parent["trace_id"] if parent else None,
+                "parent_id": parent["span_id"] if parent else None,
+                "start": time.time(),
+                "attempt": attempt,
+                "_started": time.perf_counter(),
+                "_prompt": prompt_text,
+            }
+
+    def on_llm_start(self, serialized, prompts, *, run_id, tags=None, metadata=None, **kwargs):
+        self._start(run_id, "\n".join(prompts), tags, metadata, kwargs)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, tags=None, metadata=None, **kwargs):
+        prompt_text = "\n".join(str(message.content) for batch in messages for message in batch)
+        self._start(run_id, prompt_text, tags, metadata, kwargs)
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        with self._lock:
+            run = self._runs.get(run_id)
+            if run is not None and "time_to_first_token" not in run:
+                run["time_to_first_token"] = time.perf_counter() - run["_started"]
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        with self._lock:
+            run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        usage = _usage_from(response)
+        if usage is None:
+            completion = "".join(generation.text for generations in response.generations for generation in generations)
+            usage = (count_tokens(run["_prompt"]), count_tokens(completion))
+            run["tokens_estimated"] = True
+        run["prompt_tokens"], run["completion_tokens"] = usage
+        self._finish(run)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        with self._lock:
+            run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        run["error"] = str(error)
+        self._finish(run)
+
+    def on_retry(self, retry_state, *, run_id, **kwargs):
+        # Provider-level retries (e.g. rate limits) happen inside a single LLM run
+        with self._lock:
+            run = self._runs.get(run_id)
+        self.tracer.record_retry(run["name"] if run else "unknown")
+
+    def _finish(self, run):
+        run["duration"] = time.perf_counter() - run.pop("_started")
+        run.pop("_prompt")
+        self.tracer.record_llm_call(run)
+
+_tracer = None
+_handler = None
+_tracer_lock = threading.Lock()
+
+def get_tracer():
+    global _tracer
+    with _tracer_lock:
+        if _tracer is None:
+            _tracer = Tracer()
+        return _tracer
+
+def get_llm_metrics_handler():
+    global _handler
+    tracer = get_tracer()
+    with _tracer_lock:
+        if _handler is None:
+            _handler = LLMMetricsHandler(tracer)
+        return _handler
+
+def span(name, **attributes):
+    return get_tracer().span(name, **attributes)
+
+def traced(name):
+    # Decorator form of span(); resolves the tracer per call
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -1,12 +1,15 @@
-import json
-import logging
 from langchain.output_parsers import StructuredOutputParser
+from langchain_core.exceptions import OutputParserException
+from parsing import ParseError, parse_json_output, record
 
 class CustomOutputParser(StructuredOutputParser):
     def parse(self, text):
+        # Tolerates fences, chatter and common JSON defects; checking the keys is left
+        # to parsing.validate_fields so a missing section doesn't discard the others
         try:
-            return super().parse(text)
-        except json.JSONDecodeError as e:
-            # Handle invalid escape characters by replacing them
-            text = text.replace('\\', '\\\\')
-            return super().parse(text)
+            data, path = parse_json_output(text)
+        except ParseError as e:
+            record("failed")
+            raise OutputParserException(str(e), llm_output=text)
+        record(path)
+        return data
@@ -0,0 +1,90 @@
+import streamlit as st
+from jobs import JOB_POLL_SECONDS, QUEUED
+
+def display_proposal(title, proposal):
+    st.subheader(title)
+    for section, content in proposal.items():
+        st.write(f"**{section.replace('_', ' ').title()}**")
+        st.write(content)
+        st.write("---")
+
+def display_draft_details(details):
+    # What went into the draft's prompt, as reported by the generation job
+    if details.get("research_warning"):
+        st.warning(details["research_warning"])
+    context = details.get("context")
+    if context is None:
+        return
+    st.caption(f"Context: {context['tokens']} of {context['budget']} tokens used, {len(context['dropped'])} chunks dropped")
+    if details.get("section_evidence"):
+        with st.expander("Retrieved evidence per section"):
+            for section, hits in details["section_evidence"].items():
+                st.write(f"**{section.replace('_', ' ').title()}**: " + (", ".join(f"{hit['source']} #{hit['chunk_index']} ({hit['score']:.2f})" for hit in hits) or "no matching content"))
+    if any(details.get("exemplars", {}).values()):
+        adapted = details.get("adapted", [])
+        with st.expander(f"Past proposals reused ({len(adapted)} sections adapted)"):
+            for section, hits in details["exemplars"].items():
+                if hits:
+                    st.write(f"**{section.replace('_', ' ').title()}**{' (adapted)' if section in adapted else ''}: "
+                             + ", ".join(f"{hit['client_name']} #{hit['proposal_id']} ({hit['score']:.2f})" for hit in hits))
+    if context['dropped']:
+        with st.expander("Content left out of the prompt"):
+            st.table(context['dropped'])
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def display_job_progress(job, title, sections, on_cancel=None):
+    """Show a background job's partial result, refreshing on its own until the job finishes.
+
+    Only this fragment reruns while polling; once the job is done (or ``on_cancel``, by
+    default ``job.cancel``, was called from the Cancel button) the whole page is rerun so
+    the caller can pick up the result.
+    """
+    if job.done:
+        st.rerun()
+    partial, details = job.snapshot()
+    status = "Waiting for a free worker..." if job.status == QUEUED else f"Running for {job.elapsed:.0f} s..."
+    columns = st.columns([4, 1])
+    columns[0].info(f"{title.rstrip(':')} {status} You can keep using the page; the result will appear here.")
+    if columns[1].button("Cancel", key=f"cancel_{job.id}", disabled=job.cancel_requested):
+        (on_cancel or job.cancel)()
+        st.rerun()
+    display_draft_details(details)
+    st.subheader(title)
+    for section in sections:
+        if section in partial:
+            st.write(f"**{section.replace('_', ' ').title()}**")
+            st.write(partial[section])
+            st.write("---")
+
+def display_trace_panel(tracer):
+    # Per-stage latency and per-model LLM usage since the server started, with exports
+    with st.sidebar.expander("Performance"):
+        if tracer.stages:
+            st.dataframe([{
+                "stage": name,
+                "runs": stage["count"],
+                "last (s)": round(stage["last_seconds"], 2),
+                "mean (s)": round(stage["seconds"] / stage["count"], 2),
+                "max (s)": round(stage["max_seconds"], 2),
+                "errors": stage["errors"],
+            } for name, stage in sorted(tracer.stages.items())], hide_index=True)
+        if tracer.llm:
+            st.dataframe([{
+                "model": name,
+                "calls": model["calls"],
+                "prompt tokens": model["prompt_tokens"],
+                "completion tokens": model["completion_tokens"],
+                "mean latency (s)": round(model["seconds"] / model["calls"], 2) if model["calls"] else None,
+                "mean TTFT (s)": round(model["ttft_seconds"] / model["ttft_count"], 2) if model["ttft_count"] else None,
+                "retries": model["retries"],
+                "errors": model["errors"],
+            } for name, model in sorted(tracer.llm.items())], hide_index=True)
+        if tracer.events:
+            st.dataframe([
+                {"event": kind, "path": name, "count": count} for (kind, name), count in sorted(tracer.events.items())
+            ], hide_index=True)
+        if not tracer.stages and not tracer.llm and not tracer.events:
+            st.caption("No stages have run yet.")
+            return
+        st.download_button("Download trace (JSON lines)", tracer.to_jsonl(), file_name="trace.jsonl", mime="application/x-ndjson")
+        st.download_button("Download metrics (Prometheus)", tracer.to_prometheus(), file_name="metrics.prom", mime="text/plain")